@@ -10,12 +10,14 @@ Created on Wed Nov 16 16:35:11 2016
 """
 
 
-__all__ = ['Atmosphere', 'constants', 'readprof',
-           'readprof_ozone','readprof_hr']
+__all__ = ['Atmosphere', 'AtmosphereBatch', 'constants', 'interpolation',
+           'readprof', 'readprof_ozone','readprof_hr']
 
 
 from .atmosphere import Atmosphere
+from .batch import AtmosphereBatch
 from .readprof  import readprof
 from .readprof import readprof_ozone
 from .readprof import readprof_hr
 from . import constants
+from . import interpolation
@@ -9,12 +9,40 @@ Created on Wed Nov 16 16:37:03 2016
 """
 
 from collections import MutableMapping
+from contextlib import contextmanager
 import numpy as np
 
 from . import constants
+from . import interpolation
+from .satvap import SatVapTable
 from .readprof import readprof, readprof_ozone
 
 
+#row of each variable in the level and layer state buffers
+_bufrow = {'t': 0, 'q': 1, 'rh': 2, 'o3': 3, 'z': 4}
+
+
+def _gridvar(name, var, onlev):
+    """
+    Property for a grid variable that is brought up to date when read.
+
+    The value is a view of its row in the level or layer state buffer, and
+    assigning to it copies the new values into that row in place.
+    """
+    row = _bufrow[var]
+    bufname = '_levbuf' if onlev else '_laybuf'
+
+    def fget(self):
+        if self._stale:
+            self._sync(self._syncneeds(var, onlev))
+        return self.__dict__[bufname][row]
+
+    def fset(self, value):
+        self.__dict__[bufname][row] = value
+
+    return property(fget, fset)
+
+
 class Atmosphere(MutableMapping):
     """
     Dict-like container for atmosphere array variables.
@@ -31,7 +59,14 @@ class Atmosphere(MutableMapping):
     _tmin = 100
     _tmax = 375
     _mcclathcydir = 'atmosphere/profiles/mcclatchy'
-
+    #derived-field updates, in the order they depend on each other
+    _syncorder = ('grid', 'wv', 'z', 'cold', 'warm')
+    _stale = frozenset()
+    _batchdepth = 0
+    #opt-in lookup table for satvap, see usesatvaptable()
+    _satvaptable = None
+    #variables that update() sets through their properties
+    _statevars = ('t', 'q', 'rh', 'o3', 'tsfc')
 
 
     def __init__(self, gridstagger=None, plev=None,**kwargs):
@@ -50,6 +85,10 @@ class Atmosphere(MutableMapping):
             qlev (g/g) water vapor mixing ratio
             rhlev (0<=x<=1) relative humididty
             o3lev (g/g) ozone mass mixing ratio
+
+        With lazy=True, setting t, q, rh or o3 only marks the derived fields
+        (other grid, moisture, height, cold/warm point) as stale, and each of
+        them is recomputed the first time it is read afterwards.
         """
         print("Initializing Atmosphere object")
         #check that the grid is well defined
@@ -61,48 +100,58 @@ class Atmosphere(MutableMapping):
             raise ValueError(estr.format(self.__class__.__name__))
 
         self.gridstagger = gridstagger
+        self.lazy = kwargs.get('lazy', False)
+        self._stale = set()
         self.plev = plev
         self.nlev = len(plev)
         self.nlay = self.nlev-1
 
+        #all grid variables live in one preallocated buffer per grid type,
+        #with rows ordered as in _bufrow. They are updated in place.
+        self._levbuf = np.zeros((len(_bufrow),) + self._levshape)
+        self._laybuf = np.zeros((len(_bufrow),) + self._layshape)
+
         #we need at least some kind of moisture
-        self.qlev = kwargs.get('qlev', None)
-        self.rhlev = kwargs.get('rhlev', None)
+        qlev = kwargs.get('qlev', None)
+        rhlev = kwargs.get('rhlev', None)
         self.holdrh = kwargs.get('holdrh', None)
 
         #optional, we will provide defaults
-        self.tlev = kwargs.get('tlev', None)
-        self.o3lev = kwargs.get('o3lev', None)
+        tlev = kwargs.get('tlev', None)
+        o3lev = kwargs.get('o3lev', None)
 
 
         #T defaults to isothermal
-        if (self.tlev is None):
-            self.tlev = 288.0*np.ones(len(self.plev))
+        if (tlev is None):
+            tlev = 288.0
             print("WARNING: T not provided, default to mean isothermal value.")
+        self.tlev = tlev
 
 
         # assign moisture vars with sanity checks
-        if (self.qlev is None and self.rhlev is None):
-            self.qlev = np.zeros(len(self.plev))
-            self.rhlev = np.zeros(len(self.plev))
+        if (qlev is None and rhlev is None):
+            self.qlev = 0.0
+            self.rhlev = 0.0
             print("WARNING: moisture not provided, default to 0.")
             userh = False
-        elif (self.qlev is None and self.rhlev is not None):
+        elif (qlev is None and rhlev is not None):
             print("WARNING: q not provided. Setting based on RH.")
-            self.rhlev = self._enforece_rh_range(self.rhlev)
+            self.rhlev = self._enforce_rh_range(rhlev)
             self.qlev = self._enforce_q_gradient(
                           self._rh2q(self.plev, self.tlev, self.rhlev)
                           )
             userh = True
-        elif (self.qlev is not None and self.rhlev is None):
+        elif (qlev is not None and rhlev is None):
             print("WARNING: RH not provided. Seting based on q.")
-            self.qlev = self._enforce_q_gradient(self.qlev)
+            self.qlev = qlev
+            self._enforce_q_gradient(self.qlev)
             self.rhlev = self._q2rh(self.plev, self.tlev, self.qlev)
             userh = False
         else:
             userh = True
-            self.qlev = self._enforce_q_gradient(self.qlev)
-            self.rhlev = self._enforce_rh_range(self.rhlev)
+            self.qlev = qlev
+            self._enforce_q_gradient(self.qlev)
+            self.rhlev = self._enforce_rh_range(rhlev)
 
 
         if(self.holdrh is None):
@@ -111,24 +160,27 @@ class Atmosphere(MutableMapping):
               "WARNING: holdrh not provided, setting to {0}".format(userh))
 
         #o3 defaults to 0
-        if (self.o3lev is None):
-             self.o3lev = np.zeros(len(self.plev))
+        if (o3lev is None):
+             o3lev = 0.0
              print("WARNING: ozone not provided, default to 0.")
+        self.o3lev = o3lev
 
 
 
 
-        #define layer tags
+        #define layer tags. The grids are fixed from here on, so the
+        #interpolation operators between them are looked up only once.
         self.play = 0.5*(plev[:-1] + plev[1:])
-        self.tlay = self._lev2lay(self.plev,self.tlev, self.play)
-        self.o3lay = self._lev2lay(self.plev, self.o3lev, self.play)
-        self.qlay = self._lev2lay(self.plev, self.qlev, self.play)
-        self.rhlay = self._lev2lay(self.plev, self.rhlev, self.play)
+        self._lev2layop = interpolation.InterpOperator.fromgrid(
+                                                        self.plev, self.play)
+        self._lay2levop = interpolation.InterpOperator.fromgrid(
+                                                        self.play, self.plev)
+        self._lev2layop(self._levbuf[:4], out=self._laybuf[:4])
 
         tsfc = kwargs.get('tsfc', None)
         if (tsfc is None):
             print("WARNING: tsfc not provided. Using tlev[-1].")
-            tsfc = self.tlev[-1]
+            tsfc = self.tlev[...,-1]
         self.tsfc = tsfc
 
         self._p_z()
@@ -145,12 +197,16 @@ class Atmosphere(MutableMapping):
                 raise TypeError(
                     err.format(cls=self.__class__.__name__, key=key)
                     )
-        if self.__contains__(key):
+        if key in self._gridvars:
+            setattr(self, key, value)
+        elif self.__contains__(key):
             self.__dict__[key] = value
         else:
             raise KeyError ("'{0}' not found in collection".format(key))
 
     def __getitem__(self, key):
+        if key in self._gridvars:
+            return getattr(self, key)
         return self.__dict__[key]
 
     def __delitem__(self,key):
@@ -158,7 +214,10 @@ class Atmosphere(MutableMapping):
                          .format(cls=self.__class__.__name__))
 
     def __iter__(self):
-        return self.__dict__.__iter__()
+        for key in self._gridvars:
+            yield key
+        for key in self.__dict__:
+            yield key
 
 
     def __len__(self):
@@ -168,7 +227,91 @@ class Atmosphere(MutableMapping):
             return self.nlev
 
     def __contains__(self,key):
-        return self.__dict__.__contains__(key)
+        return key in self._gridvars or self.__dict__.__contains__(key)
+
+    def update(self, *args, **kwargs):
+        """
+        Set several variables at once, with a single grid update at the end.
+
+        Takes the same arguments as dict.update. Keys may be the state
+        properties (t, q, rh, o3, tsfc) or any existing key of the collection,
+        e.g. atms.update(t=tnew, tsfc=300.0, o3=o3new).
+        """
+        with self.batch():
+            for key, value in dict(*args, **kwargs).items():
+                if key in self._statevars:
+                    setattr(self, key, value)
+                else:
+                    self[key] = value
+
+    @contextmanager
+    def batch(self, check=None):
+        """
+        Context in which any number of changes share one grid update.
+
+        Inside the block, setting t, q, rh or o3 only marks the derived
+        fields stale (reads still see up to date values). When the outermost
+        batch exits, the stale fields are updated once and check(atms) is
+        called, if given. Batches may be nested.
+        """
+        self._batchdepth += 1
+        try:
+            yield self
+        finally:
+            self._batchdepth -= 1
+        if not self._batchdepth:
+            self._sync(self._syncorder)
+            if check is not None:
+                check(self)
+
+    # %% copies and rollback
+    def clone(self, sharegrid=True):
+        """
+        Independent copy of the atmosphere.
+
+        All state arrays are copied directly, without going through the
+        generic deepcopy machinery. With sharegrid=True the fixed pressure
+        grids (plev, play) are shared with the original instead of copied;
+        they can not be changed through the mapping interface, so this is
+        safe as long as they are not modified in place.
+        """
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        shared = ('plev', 'play') if sharegrid else ()
+        for key, value in new.__dict__.items():
+            if isinstance(value, np.ndarray) and key not in shared:
+                new.__dict__[key] = value.copy()
+        new._stale = set(self._stale)
+        new._batchdepth = 0
+        return new
+
+    def __deepcopy__(self, memo):
+        return self.clone(sharegrid=False)
+
+    def snapshot(self):
+        """
+        Copy of the mutable state (state buffers, tsfc and iconv).
+
+        Pass the result to restore() to roll the atmosphere back to it.
+        """
+        self._sync(self._syncorder)
+        state = {'levbuf': self._levbuf.copy(),
+                 'laybuf': self._laybuf.copy(),
+                 'tsfc': np.array(self.tsfc)}
+        if '_iconv_top' in self.__dict__:
+            state['iconv'] = np.array(self._iconv_top)
+        return state
+
+    def restore(self, state):
+        """Roll the state back to a snapshot(). The snapshot is not changed."""
+        self._levbuf[...] = state['levbuf']
+        self._laybuf[...] = state['laybuf']
+        self.tsfc = state['tsfc'].copy()
+        self._stale.clear()
+        self._updatecoldpoint()
+        self._updatewarmpoint()
+        if 'iconv' in state:
+            self.iconv = state['iconv'].copy()
 
     # %% alternate constructors
     @classmethod
@@ -272,93 +415,112 @@ class Atmosphere(MutableMapping):
 
 
     # %% interpolation
-    @staticmethod
-    def _findvalue(x,xq):
-        """
-        Find equal or larger value in array with at least one index to left.
-
-        Array lookup should be sorted in ascending order.
-        """
-        L,R = int(1), int(len(x)-1)
-        while L < R:
-            M = int((L+R)/2)
-            if xq > x[M]:
-                L = M+1
-            elif xq < x[M]:
-                R = M
-            else:
-                return M
-        return R
-
-
     @classmethod
     def interp(cls,x,y,xq):
         """
         Interpolate linearly with extrapolation when out of range.
 
-        Expects xq to be a vector (i.e., numpy 1D array).
+        Expects xq to be a vector (i.e., numpy 1D array). y may be a single
+        profile or a stack of profiles on the x grid, in which case all of
+        them are interpolated in one call.
         """
-        yq =  np.empty(len(xq)) #yq needs to be same type as xq
-        for iout,target in enumerate(xq):
-            idx = cls._findvalue(x,target)
-            f = (target-x[idx-1])/(x[idx]-x[idx-1])
-            yq[iout] = (1-f)*y[idx-1] + f*y[idx]
-        return yq
+        return interpolation.interp(x,y,xq)
 
     @classmethod
     def _lev2lay(cls,plev,xlev,play):
         """Move Level vars to layers"""
-        return  cls.interp(plev, xlev, play)
+        return interpolation.InterpOperator.fromgrid(plev, play)(xlev)
 
-    @classmethod #remake so that it takes generic arguments and returns a vecotr
+    @classmethod
     def _lay2lev(cls,play,xlay,plev):
         """Move Layer vars to levels"""
-        return cls.interp(play,xlay,plev)
+        return interpolation.InterpOperator.fromgrid(play, plev)(xlay)
 
 
     def updategrid(self):
         """
         Interpolate temperature to all levels/layers. Spread WV variables too.
         """
+        self._stale.update(self._syncorder)
+        self._sync(self._syncorder)
+
+    def _gridchanged(self):
+        """
+        Update derived fields now, or mark them stale in lazy/batch mode.
+        """
+        if self.lazy or self._batchdepth:
+            self._stale.update(self._syncorder)
+        else:
+            self.updategrid()
+
+    def _syncneeds(self, var, onlev):
+        """Derived-field updates that a read of var on a given grid needs."""
+        if var == 'z':
+            return ('grid', 'wv', 'z')
+        if (var == 'q' and self.holdrh) or (var == 'rh' and not self.holdrh):
+            return ('grid', 'wv')
+        if onlev == self.gridstagger:
+            return ('grid',)
+        return ()
+
+    def _sync(self, needs):
+        """
+        Run the stale updates listed in needs, in dependency order.
+
+        Reads made by the updates themselves see the raw stored values and
+        never trigger further updates.
+        """
+        stale = self._stale
+        self._stale = frozenset()
+        try:
+            for step in self._syncorder:
+                if step in needs and step in stale:
+                    stale.discard(step)
+                    self._syncstep[step](self)
+        finally:
+            self._stale = stale
+
+    def _interpgrid(self):
+        """Interpolate t, q, rh and o3 from the native grid to the other."""
         if(self.gridstagger):
-            self['tlev'] = self._lay2lev(
-                           self['play'], self['tlay'], self['plev']
-                           )
-            self['qlev'] = self._lay2lev(
-                           self['play'], self['qlay'], self['plev']
-                           )
-            self['rhlev'] = self._lay2lev(
-                           self['play'], self['rhlay'], self['plev']
-                           )
-            self['o3lev'] = self._lay2lev(
-                           self['play'], self['o3lay'], self['plev']
-                           )
+            self._lay2levop(self._laybuf[:4], out=self._levbuf[:4])
         else:
-            self['tlay'] = self._lev2lay(
-                               self['plev'], self['tlev'], self['play']
-                               )
-            self['qlay'] = self._lev2lay(
-                               self['plev'], self['qlev'], self['play']
-                               )
-            self['rhlay'] = self._lev2lay(
-                               self['plev'], self['rhlev'], self['play']
-                               )
-            self['o3lay'] = self._lay2lev(
-                           self['plev'], self['o3lev'], self['play']
-                           )
-        self._updatewv()
-        self._p_z()
-        self._updatecoldpoint()
-        self._updatewarmpoint()
+            self._lev2layop(self._levbuf[:4], out=self._laybuf[:4])
 
     # %% moisture
-    @staticmethod
-    def satvap(temp):
+    @classmethod
+    def usesatvaptable(cls, use=True, dt=None):
+        """
+        Switch satvap (and so satmixrat, _q2rh, _rh2q) to a lookup table.
+
+        The table spans [_tmin, _tmax] with spacing dt (K); see SatVapTable
+        for its accuracy. use=False goes back to the full expression.
+        """
+        if use:
+            cls._satvaptable = SatVapTable(
+                cls._goffgratch, cls._tmin, cls._tmax, dt)
+            print("{cls}: using satvap table, dt = {dt} K, "
+                  "max. rel. error {err:.1e}".format(
+                  cls=cls.__name__, dt=cls._satvaptable.dt,
+                  err=cls._satvaptable.maxrelerr))
+        else:
+            cls._satvaptable = None
+
+    @classmethod
+    def satvap(cls, temp):
         """
         Saturation Vapor pressure (Goff and Gratch, 1946)
 
-        Temp is the temperature in Kelvins and may be a numpy array
+        Temp is the temperature in Kelvins and may be a numpy array. Uses the
+        lookup table when enabled with usesatvaptable().
         """
+        if cls._satvaptable is not None:
+            return cls._satvaptable(temp)
+        return cls._goffgratch(temp)
+
+    @staticmethod
+    def _goffgratch(temp):
+        """Full Goff-Gratch expression for saturation vapor pressure (hPa)."""
 
         ttrans = 0 #253.15
         tsteam = 373.16
@@ -403,10 +565,17 @@ class Atmosphere(MutableMapping):
 
     @classmethod
     def _enforce_q_gradient(cls, q):
-        """Ensure q decrease with height"""
-        q[-1] = np.maximum(q[-1], cls._qmin)
-        for i in np.arange(len(q)-1,0,-1):
-            q[i-1] = np.maximum(np.minimum(q[i], q[i-1]), cls._qmin)
+        """
+        Ensure q decrease with height
+
+        Each value is limited by the smallest value below it (a reverse
+        cumulative minimum from the surface) and floored at _qmin. Works
+        along the last axis, so (column x level) input is handled as well.
+        q is modified in place and returned.
+        """
+        np.maximum(
+            np.minimum.accumulate(q[...,::-1], axis=-1)[...,::-1],
+            cls._qmin, out=q)
         return q
 
     @classmethod
@@ -437,32 +606,62 @@ class Atmosphere(MutableMapping):
         tv = self.tlay*(1 + (1-1/constants.eps)*self.qlay)
         dz = ( (constants.Rd/constants.grav)
               *np.log(self.plev[1:]/self.plev[:-1]) * tv )
-        zlev = np.zeros(len(self.plev))
-        zlev[1:] = np.cumsum(dz[::-1])
-        self.zlev = zlev[::-1]
-        self.zlay = self._lev2lay(
-                        self.plev, self.zlev, self.play)
+        #integrate upward from the surface (last index)
+        zlev = self._levbuf[_bufrow['z']]
+        zlev[...,-1] = 0.0
+        zlev[...,:-1] = np.cumsum(dz[...,::-1], axis=-1)[...,::-1]
+        self._lev2layop(zlev, out=self._laybuf[_bufrow['z']])
 
     #%% get cold point and conv. top
     def _updatecoldpoint(self):
         mask = np.logical_and(
                     self.p <= self._ttl_pmax, self.p >= self._ttl_pmin)
-        icold_point = np.argmin(np.where(mask, self.t, 99999))
+        icold_point = np.argmin(np.where(mask, self.t, 99999), axis=-1)
         self._icold_point = icold_point
 
     def _updatewarmpoint(self):
         mask = self.p >= self._ttl_pmax
-        iwarm_point = np.argmax(np.where(mask, self.t, -99999))
+        iwarm_point = np.argmax(np.where(mask, self.t, -99999), axis=-1)
         self._iwarm_point = iwarm_point
 
 
     # %% property variables for more obvious getting and setting
 
     def _checkvar(self, value):
-        if len(self) != len(value):
+        """Check the length of a new native-grid variable and return it."""
+        if np.shape(value)[-1:] != (len(self),):
             raise ValueError(
                 "Length of array provided does not match the target dimension"
                 )
+        return value
+
+    def _copyfields(self, fields, tsfc):
+        """
+        Overwrite grid variables and tsfc with copies of the given values.
+
+        The values are taken as consistent with each other, so only the
+        cold and warm points are recomputed.
+        """
+        for key, value in fields.items():
+            setattr(self, key, value)
+        self.tsfc = tsfc
+        self._stale.clear()
+        self._updatecoldpoint()
+        self._updatewarmpoint()
+
+    @property
+    def _levshape(self):
+        """Shape of a level variable."""
+        return (self.nlev,)
+
+    @property
+    def _layshape(self):
+        """Shape of a layer variable."""
+        return self._levshape[:-1] + (self.nlay,)
+
+    def _pick(self, x, idx):
+        """Value of native-grid variable x at index idx (e.g. icold)."""
+        return x[idx]
 
     @property
     def t(self):
@@ -473,12 +672,14 @@ class Atmosphere(MutableMapping):
 
     @t.setter
     def t(self, value):
-        self._checkvar(value)
+        value = self._checkvar(value)
         if(self.gridstagger):
-            self.tlay = np.minimum(np.maximum(value,self._tmin),self._tmax)
+            np.clip(value, self._tmin, self._tmax,
+                    out=self._laybuf[_bufrow['t']])
         else:
-            self.tlev = np.minimum(np.maximum(value,self._tmin),self._tmax)
-        self.updategrid()
+            np.clip(value, self._tmin, self._tmax,
+                    out=self._levbuf[_bufrow['t']])
+        self._gridchanged()
 
     @property
     def tsfc(self):
@@ -497,7 +698,7 @@ class Atmosphere(MutableMapping):
 
     @q.setter
     def q(self,value):
-        self._checkvar(value)
+        value = self._checkvar(value)
         if (self.holdrh):
             print(
               "WARNING: holdrh set to True, but setting q directly. "
@@ -507,7 +708,7 @@ class Atmosphere(MutableMapping):
             self.qlay = value
         else:
             self.qlev = value
-        self.updategrid()
+        self._gridchanged()
 
     @property
     def rh(self):
@@ -518,7 +719,7 @@ class Atmosphere(MutableMapping):
 
     @rh.setter
     def rh(self,value):
-        self._checkvar(value)
+        value = self._checkvar(value)
         if (not self.holdrh):
             print(
                 "WARNING: holdrh set to False, but setting RH directly. "
@@ -528,7 +729,7 @@ class Atmosphere(MutableMapping):
             self.rhlay = value
         else:
             self.rhlev = value
-        self.updategrid()
+        self._gridchanged()
 
     @property
     def o3(self):
@@ -539,12 +740,12 @@ class Atmosphere(MutableMapping):
 
     @o3.setter
     def o3(self, value):
-        self._checkvar(value)
+        value = self._checkvar(value)
         if(self.gridstagger):
             self.o3lay = value
         else:
             self.o3lev = value
-        self.updategrid()
+        self._gridchanged()
 
     @property
     def p(self):
@@ -562,31 +763,33 @@ class Atmosphere(MutableMapping):
 
     @property
     def tcold(self):
-        return self.t[self.icold]
+        return self._pick(self.t, self.icold)
 
     @property
     def pcold(self):
-        return self.p[self.icold]
+        return self._pick(self.p, self.icold)
 
     @property
     def zcold(self):
-        return self.z[self.icold]
+        return self._pick(self.z, self.icold)
 
     @property
     def icold(self):
+        if self._stale:
+            self._sync(('cold',))
         return self._icold_point
 
     @property
     def tconv(self):
-        return self.t[self.iconv]
+        return self._pick(self.t, self.iconv)
 
     @property
     def pconv(self):
-        return self.p[self.iconv]
+        return self._pick(self.p, self.iconv)
 
     @property
     def zconv(self):
-        return self.z[self.iconv]
+        return self._pick(self.z, self.iconv)
 
     #although icold is calculated internally, not all atmospheres will need a
     # convective top(iconv). Provide a setter method so that external objects
@@ -607,19 +810,35 @@ class Atmosphere(MutableMapping):
 
     @property
     def twarm(self):
-        return self.t[self.iwarm]
+        return self._pick(self.t, self.iwarm)
 
     @property
     def pwarm(self):
-        return self.p[self.iwarm]
+        return self._pick(self.p, self.iwarm)
 
 
     @property
     def iwarm(self):
+        if self._stale:
+            self._sync(('warm',))
         return self._iwarm_point
 
-
-
-
-
-
+    # %% grid variables (see _gridvar)
+    tlev = _gridvar('tlev', 't', True)
+    tlay = _gridvar('tlay', 't', False)
+    qlev = _gridvar('qlev', 'q', True)
+    qlay = _gridvar('qlay', 'q', False)
+    rhlev = _gridvar('rhlev', 'rh', True)
+    rhlay = _gridvar('rhlay', 'rh', False)
+    o3lev = _gridvar('o3lev', 'o3', True)
+    o3lay = _gridvar('o3lay', 'o3', False)
+    zlev = _gridvar('zlev', 'z', True)
+    zlay = _gridvar('zlay', 'z', False)
+    _gridvars = ('tlev', 'tlay', 'qlev', 'qlay', 'rhlev', 'rhlay',
+                 'o3lev', 'o3lay', 'zlev', 'zlay')
+
+    _syncstep = {'grid': _interpgrid,
+                 'wv': _updatewv,
+                 'z': _p_z,
+                 'cold': _updatecoldpoint,
+                 'warm': _updatewarmpoint}
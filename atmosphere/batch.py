@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-column Atmosphere container.
+"""
+
+__all__ = ['AtmosphereBatch']
+
+
+import numpy as np
+
+from .atmosphere import Atmosphere
+
+
+class AtmosphereBatch(Atmosphere):
+    """
+    Atmosphere holding ncol independent columns on a shared pressure grid.
+
+    Grid variables have shape (ncol, nlev) or (ncol, nlay) and tsfc has shape
+    (ncol,). Every Atmosphere operation (interpolation, moisture, height,
+    cold/warm point) acts on all columns in one NumPy call, and icold/iwarm
+    and the derived tcold, pcold, ... are per-column arrays.
+    """
+
+    _colvars = ('tlev', 'qlev', 'rhlev', 'o3lev')
+
+    def __init__(self, gridstagger=None, plev=None, ncol=None, **kwargs):
+        """
+        Accepts the Atmosphere arguments plus the number of columns.
+
+        Column variables may be given per column (ncol, nlev) or as a single
+        profile (nlev) that is copied to every column; tsfc may be a scalar
+        or have shape (ncol,). If ncol is not given, it is taken from the
+        first per-column input.
+        """
+        if ncol is None:
+            for key in self._colvars:
+                if np.ndim(kwargs.get(key, None)) == 2:
+                    ncol = np.shape(kwargs[key])[0]
+                    break
+            else:
+                if np.ndim(kwargs.get('tsfc', None)) == 1:
+                    ncol = len(kwargs['tsfc'])
+        if ncol is None:
+            estr = "{} class requires ncol or per-column inputs."
+            raise ValueError(estr.format(self.__class__.__name__))
+        if plev is None:
+            estr = "{} class requires ndarray plev input."
+            raise ValueError(estr.format(self.__class__.__name__))
+
+        self.ncol = ncol
+        for key in self._colvars:
+            if kwargs.get(key, None) is not None:
+                kwargs[key] = np.array(np.broadcast_to(
+                    kwargs[key], (ncol, len(plev))), dtype=float)
+        if kwargs.get('tsfc', None) is not None:
+            kwargs['tsfc'] = np.array(np.broadcast_to(
+                kwargs['tsfc'], (ncol,)), dtype=float)
+
+        super().__init__(gridstagger=gridstagger, plev=plev, **kwargs)
+
+    @classmethod
+    def fromcolumns(cls, columns):
+        """
+        Stack a sequence of Atmosphere objects on the same grid into a batch.
+
+        All grid variables are copied as they are, so the batch reproduces
+        each column exactly. As in clone(), the batch is assembled directly
+        from the state buffers of the columns instead of being constructed
+        and then overwritten; grid and flags are taken from the first column.
+        """
+        first = columns[0]
+        for atms in columns[1:]:
+            if (atms.gridstagger != first.gridstagger
+                    or not np.array_equal(atms.plev, first.plev)):
+                estr = "{} columns must share gridstagger and plev."
+                raise ValueError(estr.format(cls.__name__))
+        for atms in columns:
+            atms._sync(atms._syncorder)
+
+        batch = cls.__new__(cls)
+        batch.__dict__.update(first.__dict__)
+        batch.__dict__.pop('_iconv_top', None)
+        batch.ncol = len(columns)
+        batch._stale = set()
+        batch._batchdepth = 0
+        batch._levbuf = np.stack([atms._levbuf for atms in columns], axis=1)
+        batch._laybuf = np.stack([atms._laybuf for atms in columns], axis=1)
+        batch.tsfc = np.array([atms.tsfc for atms in columns], dtype=float)
+        batch._updatecoldpoint()
+        batch._updatewarmpoint()
+        #convective tops are per column; columns without one use icold
+        if any('_iconv_top' in atms.__dict__ for atms in columns):
+            batch.iconv = np.array(
+                [atms.__dict__.get('_iconv_top', atms.icold)
+                 for atms in columns], dtype=int)
+        return batch
+
+    def column(self, icol):
+        """Return column icol as a separate (single-column) Atmosphere."""
+        self._sync(self._syncorder)
+
+        atms = Atmosphere.__new__(Atmosphere)
+        atms.__dict__.update(self.__dict__)
+        atms.__dict__.pop('ncol')
+        atms.__dict__.pop('_iconv_top', None)
+        atms._stale = set()
+        atms._batchdepth = 0
+        atms._levbuf = self._levbuf[:,icol].copy()
+        atms._laybuf = self._laybuf[:,icol].copy()
+        atms.tsfc = self.tsfc[icol]
+        atms._updatecoldpoint()
+        atms._updatewarmpoint()
+        if '_iconv_top' in self.__dict__:
+            atms.iconv = int(np.broadcast_to(self._iconv_top,
+                                             (self.ncol,))[icol])
+        return atms
+
+    # %% per-column overrides
+    def _checkvar(self, value):
+        """Check a new native-grid variable and spread 1-D input to all."""
+        value = super()._checkvar(value)
+        if np.ndim(value) == 1:
+            value = np.array(np.broadcast_to(value, (self.ncol, len(self))))
+        return value
+
+    @property
+    def _levshape(self):
+        return (self.ncol, self.nlev)
+
+    def _pick(self, x, idx):
+        if np.ndim(x) == 1:
+            return x[idx]
+        return x[np.arange(self.ncol), idx]
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vectorized linear interpolation engine for vertical profiles.
+
+All routines operate along the last axis, so a stack of variables
+(e.g. t, q, rh, o3, z) sharing the same source grid can be interpolated in a
+single call.
+"""
+
+__all__ = ['interpweights', 'interp', 'InterpOperator']
+
+
+from collections import OrderedDict
+import numpy as np
+
+
+def interpweights(x, xq):
+    """
+    Bracketing indices and weights for linear interpolation of x onto xq.
+
+    x must be sorted in ascending order. Returns (idx, f) such that the value
+    at xq is (1-f)*y[idx-1] + f*y[idx]. Targets outside the range of x are
+    linearly extrapolated from the two end points.
+    """
+    x = np.asarray(x, dtype=float)
+    xq = np.asarray(xq, dtype=float)
+    idx = np.clip(np.searchsorted(x, xq, side='left'), 1, len(x)-1)
+    x0 = x[idx-1]
+    f = (xq-x0)/(x[idx]-x0)
+    return idx, f
+
+
+def interp(x, y, xq):
+    """
+    Interpolate linearly with extrapolation when out of range.
+
+    y may be a single profile or a stack of profiles (..., len(x)); the result
+    has shape (..., len(xq)).
+    """
+    idx, f = interpweights(x, xq)
+    y = np.asarray(y, dtype=float)
+    y0 = y[..., idx-1]
+    return y0 + f*(y[..., idx]-y0)
+
+
+class InterpOperator(object):
+    """
+    Precomputed linear interpolation from grid x onto grid xq.
+
+    Stores the bracketing indices and weights once so that repeated
+    interpolation between two fixed grids is a gather plus a single
+    multiply-add. Operators are shared between all users of the same pair of
+    grids through fromgrid().
+    """
+
+    #bounded cache of operators, keyed by the bytes of both grids
+    _cache = OrderedDict()
+    _cachesize = 64
+
+    def __init__(self, x, xq):
+        idx, f = interpweights(x, xq)
+        self.ilo = idx-1
+        self.ihi = idx
+        self.f = f
+        self.nin = len(x)
+        self.nout = len(f)
+
+    @staticmethod
+    def gridkey(x, xq):
+        """Hashable key identifying the (x, xq) grid pair."""
+        x = np.ascontiguousarray(x, dtype=float)
+        xq = np.ascontiguousarray(xq, dtype=float)
+        return (x.tobytes(), xq.tobytes())
+
+    @classmethod
+    def fromgrid(cls, x, xq):
+        """
+        Return the cached operator for (x, xq), building it on first use.
+        """
+        key = cls.gridkey(x, xq)
+        try:
+            op = cls._cache.pop(key)
+        except KeyError:
+            op = cls(x, xq)
+            if len(cls._cache) >= cls._cachesize:
+                cls._cache.popitem(last=False)
+        cls._cache[key] = op
+        return op
+
+    def __call__(self, y, out=None):
+        """
+        Apply the operator to a profile or a stack of profiles (..., nin).
+
+        The result is written to out, if given, which must not overlap y.
+        """
+        y = np.asarray(y, dtype=float)
+        y0 = y[..., self.ilo]
+        out = np.subtract(y[..., self.ihi], y0, out=out)
+        out *= self.f
+        out += y0
+        return out
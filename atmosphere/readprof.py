@@ -11,42 +11,131 @@ Created on Thu Nov 17 09:57:08 2016
 __all__ = ['readprof']
 
 
+from collections import OrderedDict
+import os
+import tempfile
 import numpy as np
 
 
-def readprof(fname):
-    return readprof_full(fname)
+#parsed tables are kept in memory (bounded LRU) and in binary form on disk,
+#both keyed by the source file's path and modification time. The readers
+#take diskcache=False to skip the disk tier; usediskcache is the default.
+#Note that the package exports the function atmosphere.readprof, so the
+#default of this module is sys.modules['atmosphere.readprof'].usediskcache.
+_lrusize = 32
+_lru = OrderedDict()
+_cachedirname = '.profcache'
+usediskcache = True
 
-def readprof_full(fname):
+
+def _loadtable(fname, skiprows, usecols, diskcache=None):
+    """
+    np.loadtxt(fname, skiprows, usecols, unpack=True), through the caches.
+
+    Returns a tuple of fresh arrays, so callers may modify them.
+    """
+    if diskcache is None:
+        diskcache = usediskcache
+    stat = os.stat(fname)
+    key = (os.path.abspath(fname), stat.st_mtime_ns, stat.st_size,
+           skiprows, tuple(usecols))
+    try:
+        data = _lru.pop(key)
+    except KeyError:
+        data = _loaddisk(fname, stat, skiprows, usecols, diskcache)
+        if len(_lru) >= _lrusize:
+            _lru.popitem(last=False)
+    _lru[key] = data
+    return tuple(col.copy() for col in data)
+
+def _diskcachename(fname, stat, skiprows, usecols):
+    """Binary cache file for a table; the name encodes the source version."""
+    dirname, basename = os.path.split(os.path.abspath(fname))
+    tag = '_'.join(str(i) for i in (skiprows,) + tuple(usecols))
+    return os.path.join(dirname, _cachedirname, '{}.{}.{}-{}.npy'.format(
+                        basename, tag, stat.st_mtime_ns, stat.st_size))
+
+def _loaddisk(fname, stat, skiprows, usecols, diskcache):
+    """
+    Load the binary copy of a table, regenerating it if the source changed.
+
+    The copy is written to a temporary file and renamed into place, so
+    other processes never read a partial file.
+    """
+    cachename = _diskcachename(fname, stat, skiprows, usecols)
+    if diskcache:
+        try:
+            return np.load(cachename)
+        except (OSError, ValueError, EOFError):
+            pass
+
+    data = np.loadtxt(fname, skiprows=skiprows, usecols=usecols, unpack=True)
+
+    if diskcache:
+        try:
+            #drop copies made from older versions of the source
+            prefix = os.path.basename(cachename).rsplit('.', 2)[0] + '.'
+            cachedir = os.path.dirname(cachename)
+            os.makedirs(cachedir, exist_ok=True)
+            for old in os.listdir(cachedir):
+                if old.startswith(prefix) and old != os.path.basename(
+                        cachename):
+                    try:
+                        os.remove(os.path.join(cachedir, old))
+                    except OSError:
+                        pass
+            fd, tmpname = tempfile.mkstemp(dir=cachedir, prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, data)
+                os.replace(tmpname, cachename)
+            except OSError:
+                os.remove(tmpname)
+                raise
+        except OSError:
+            #read-only data directories just go without the disk cache
+            pass
+    return data
+
+def clearcache():
+    """Empty the in-process profile cache (the disk cache is kept)."""
+    _lru.clear()
+
+
+def readprof(fname, diskcache=None):
+    return readprof_full(fname, diskcache)
+
+def readprof_full(fname, diskcache=None):
     """
     Read ASCII table of p,t,q,o3 and return the result as an ndarray tuple.
     """
     #skip first row which contains metadata, then unpack the remainder of data
-    p,t,q,o3 = np.loadtxt(fname, skiprows=1, usecols=(0,1,2,3), unpack=True)
+    p,t,q,o3 = _loadtable(fname, skiprows=1, usecols=(0,1,2,3),
+                          diskcache=diskcache)
 
     if p[1] > p[0]: #pressure increases with index
         return p,t,q,o3
     else:
         return p[::-1],t[::-1],q[::-1],o3[::-1]
 
-def readprof_ozone(fname):
+def readprof_ozone(fname, diskcache=None):
     """
     Get Ozone data only from file, with pressure.
     """
 
-    p,o3 = np.loadtxt(fname, skiprows=1, usecols=(0,1), unpack=True)
+    p,o3 = _loadtable(fname, skiprows=1, usecols=(0,1), diskcache=diskcache)
 
     if p[1] > p[0]: #pressure increases with index
         return p,o3
     else:
         return p[::-1],o3[::-1]
 
-def readprof_hr(fname):
+def readprof_hr(fname, diskcache=None):
     """
     HR from file
     """
-    z, hrir, hrsw = np.loadtxt(
-                             fname, skiprows=1, usecols=(0,2,1), unpack=True)
+    z, hrir, hrsw = _loadtable(fname, skiprows=1, usecols=(0,2,1),
+                               diskcache=diskcache)
     #convert to m from km, if the values look like they are in km
     if not any(z>100):
         z*=1000
@@ -12,7 +12,6 @@ Created on Fri Dec  9 11:22:51 2016
 import numpy as np
 import matplotlib.pyplot as plt
 import time
-import copy
 
 
 import atmosphere as a
@@ -97,10 +96,10 @@ for name,cond in cldconds.items():
     atms[name] = a.Atmosphere.mcclatchy(prof, p=plev, rhlev=rh, holdrh=holdrh,
                                         gridstagger=gridstagger,tsfc=ts)
     atms[name].ozone_fromfile(o3conds[name])
-    atms_noco2[name] = copy.deepcopy(atms[name])
-    atms_noo3[name] = copy.deepcopy(atms[name])
+    atms_noco2[name] = atms[name].clone()
+    atms_noo3[name] = atms[name].clone()
     atms_noo3[name].o3 = np.zeros(len(atms_noo3[name]))
-    atms_wvonly[name] = copy.deepcopy(atms[name])
+    atms_wvonly[name] = atms[name].clone()
     atms_wvonly[name].o3 = np.zeros(len(atms_wvonly[name]))
 
     mu=solar.mubar(lat,decl)
@@ -116,16 +115,23 @@ for name,cond in cldconds.items():
 
     atms[name],flx[name],hr[name] = slv.solve(
                                         atms[name],cparm,lwparm,swparm[name])
-    atms_noco2[name], flx_noco2[name], hr_noco2[name] = radslv.solve(
-        atms_noco2[name],cparm_noco2, lwparm,swparm[name])
-    atms_noo3[name], flx_noo3[name], hr_noo3[name] = radslv.solve(
-        atms_noo3[name],cparm,lwparm,swparm[name])
-    atms_wvonly[name], flx_wvonly[name], hr_wvonly[name] = radslv.solve(
-        atms_wvonly[name], cparm_noco2, lwparm,swparm[name])
     ed = time.clock()
     print(timestr.format(ed-st2))
     st2 = ed
 
+#attribution runs for all cases share one batched radiation call
+attrib = [(atms_noco2, flx_noco2, hr_noco2, cparm_noco2),
+          (atms_noo3, flx_noo3, hr_noo3, cparm),
+          (atms_wvonly, flx_wvonly, hr_wvonly, cparm_noco2)]
+runs = [(run, name) for run in attrib for name in anames]
+_, flxs, hrs = radslv.solve_batch(
+    [run[0][name] for run, name in runs], [run[3] for run, name in runs],
+    lwparm, [swparm[name] for run, name in runs])
+for (run, name), f, h in zip(runs, flxs, hrs):
+    run[1][name] = f
+    run[2][name] = h
+ed = time.clock()
+print(timestr.format(ed-st2))
 
 print('Total time: {}'.format(ed-st))
 
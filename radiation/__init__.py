@@ -9,8 +9,12 @@ Created on Tue Nov 15 17:44:56 2016
 """
 
 
-__all__ = ['RadModelFactory']
+__all__ = ['RadModelFactory', 'CachedRadModel', 'LinearizedRadModel',
+           'RadWorkerPool']
 
 
 from .factory import RadModelFactory
+from .cache import CachedRadModel
+from .linearized import LinearizedRadModel
+from .pool import RadWorkerPool
 
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-band two-stream radiation in the RCE model.
+
+A k-distribution model in pure NumPy, between the gray models and RRTMG in
+both cost and fidelity. The LW k-distributions are derived from simple
+spectral models of the H2O, CO2 and O3 bands (absorption falling off
+exponentially from the band centers, plus the H2O self continuum); the SW
+uses a water vapor k-distribution of the Lacis and Hansen type and ozone
+absorption in the UV and visible. Both are solved for all g-points, layers
+and columns at once with the non-scattering two-stream of the gray models.
+"""
+
+__all__ = ['BandModel']
+
+
+from radiation.radiation import RadModel, Flux
+from radiation.gray import sourcefluxes, swfluxes, sigma, diffusivity
+import atmosphere.constants as c
+import numpy as np
+
+
+#planck's constant (J s), speed of light (m s-1), boltzmann constant (J K-1)
+_h = 6.62607e-34
+_clight = 2.99792458e8
+_kb = 1.380649e-23
+
+#exponential band models k = k0*exp(-|nu - nu0|/l) (m2 kg-1, cm-1, cm-1)
+#at pressure pref (hPa); k scales linearly with pressure (collision
+#broadening) down to pdoppler (hPa), below which Doppler broadening holds it
+_lines = {
+    'h2o': ((127.0, 150.0, 56.0), (120.0, 1500.0, 40.0)),
+    'co2': ((110.0, 667.5, 10.2),),
+    'o3': ((500.0, 1042.0, 15.0),),
+    }
+_pref = {'h2o': 500.0, 'co2': 100.0, 'o3': 100.0}
+_pdoppler = 10.0
+
+#H2O self continuum (m2 kg-1 per atm of vapor pressure at 296 K, 1000 cm-1),
+#its e-folding scale in wavenumber (cm-1) and temperature dependence (K)
+_kself = 0.6
+_lself = 300.0
+_tself = 1800.0
+
+#LW bands: (lower, upper wavenumber (cm-1), gas the g-points are sorted by,
+#number of g-points)
+_lwbands = (
+    (10.0, 350.0, 'h2o', 6),
+    (350.0, 500.0, 'h2o', 6),
+    (500.0, 580.0, 'h2o', 4),
+    (580.0, 630.0, 'co2', 4),
+    (630.0, 705.0, 'co2', 8),
+    (705.0, 800.0, 'co2', 6),
+    (800.0, 980.0, 'h2o', 4),
+    (980.0, 1100.0, 'o3', 6),
+    (1100.0, 1250.0, 'h2o', 4),
+    (1250.0, 1450.0, 'h2o', 6),
+    (1450.0, 1850.0, 'h2o', 8),
+    (1850.0, 3000.0, 'h2o', 4),
+    )
+
+#SW g-points: (fraction of the solar flux, k of H2O, CO2, O3 (m2 kg-1)).
+#H2O follows Lacis and Hansen (1974); the ozone terms stand for the Hartley,
+#Huggins, near-UV and Chappuis bands; one term for the CO2 near-IR bands.
+_swgpoints = (
+    (0.006, 0.0, 0.0, 1.0e4),
+    (0.012, 0.0, 0.0, 300.0),
+    (0.065, 0.0, 0.0, 0.5),
+    (0.380, 0.0, 0.0, 3.0),
+    (0.181, 4.0e-6, 0.0, 0.0),
+    (0.003, 0.0, 0.1, 0.0),
+    (0.0698, 2.0e-4, 0.0, 0.0),
+    (0.1443, 3.5e-3, 0.0, 0.0),
+    (0.0584, 0.0377, 0.0, 0.0),
+    (0.0335, 0.195, 0.0, 0.0),
+    (0.0225, 0.94, 0.0, 0.0),
+    (0.0158, 4.46, 0.0, 0.0),
+    (0.0087, 19.0, 0.0, 0.0),
+    )
+#reference pressure (hPa) of the H2O and CO2 SW coefficients
+_swpref = 1013.0
+
+#temperature grid (K) of the Planck fraction tables
+_tgrid = np.arange(100.0, 401.0)
+
+
+def _planck(nu, t):
+    """
+    Hemispheric Planck flux density pi*B (W m-2 (cm-1)-1) at wavenumbers nu
+    (cm-1) and temperatures t (K), broadcast against each other.
+    """
+    x = 100.0*nu
+    with np.errstate(over='ignore'):
+        return (1.0e2*np.pi*2.0*_h*_clight**2*x**3
+                / np.expm1(_h*_clight*x/(_kb*t)))
+
+
+def _linespectrum(gas, nu):
+    """Band-model absorption coefficient of gas at wavenumbers nu."""
+    k = np.zeros(np.shape(nu))
+    for k0, nu0, width in _lines[gas]:
+        k += k0*np.exp(-np.abs(nu - nu0)/width)
+    return k
+
+
+def lwtable(dnu=0.5):
+    """
+    Tabulate the LW k-distribution.
+
+    Within each band the wavenumbers are sorted by the absorption of the
+    band's key gas and split into g-points of equal width. Every g-point
+    gets the mean log absorption coefficient of the key gas, the mean
+    coefficients of the other gases and the continuum, and the exact
+    fraction of the Planck flux emitted at its wavenumbers as a function of
+    temperature, which keeps the correlation between emission and
+    absorption within the band.
+
+    Returns a dict with 'k' (gas: (ng,)), 'kself' (ng,) and 'frac'
+    (ng, len(_tgrid)).
+    """
+    k = {gas: [] for gas in _lines}
+    kself = []
+    frac = []
+    norm = sigma*_tgrid**4
+    for lo, hi, key, ng in _lwbands:
+        nu = np.arange(lo + 0.5*dnu, hi, dnu)
+        spectra = {gas: _linespectrum(gas, nu) for gas in _lines}
+        cont = _kself*np.exp(-(np.clip(nu, 500.0, 1250.0)-1000.0)/_lself)
+        order = np.argsort(spectra[key])
+        for idx in np.array_split(order, ng):
+            for gas in _lines:
+                if gas == key:
+                    k[gas].append(np.exp(np.mean(np.log(
+                        np.maximum(spectra[gas][idx], 1.0e-30)))))
+                else:
+                    k[gas].append(np.mean(spectra[gas][idx]))
+            kself.append(np.mean(cont[idx]))
+            frac.append(dnu*np.sum(
+                _planck(nu[idx,np.newaxis], _tgrid), axis=0)/norm)
+
+    frac = np.array(frac)
+    return {'k': {gas: np.array(k[gas]) for gas in k},
+            'kself': np.array(kself),
+            'frac': frac/np.sum(frac, axis=0)}
+
+
+class BandModel(RadModel):
+    """
+    Multi-band two-stream radiation model.
+
+    Uses the LW k-distribution tabulated by lwtable (about 60 g-points in 12
+    bands) and the SW g-points in _swgpoints, with H2O (qlay), CO2 (ChemParm
+    co2ppmv) and O3 (o3lay) as absorbers. Clouds, scattering and the minor
+    gases of RRTMG are not included; Rayleigh scattering and clouds may be
+    represented through the surface albedo.
+
+    Against the line-by-line profiles in atmosphere/profiles/hr/LBL_HR
+    (see testbands.py) the OLR is within about 1 W m-2 and the LW heating
+    rates within 0.2 K/day rms in the troposphere and 0.4 K/day in the
+    stratosphere. The SW heating rates are within 0.15 (troposphere) and
+    0.8 K/day (stratosphere), but the clear-sky SW absorption of the
+    atmosphere is about 18 W m-2 too low.
+    """
+
+    _packed = True
+    _lwtable = None
+    #CO2 mass mixing ratio per ppmv
+    _co2mmr = 1.0e-6*44.01/c.Md
+
+    def __init__(self, **kwargs):
+        print('initializing {} object'.format(self.__class__.__name__))
+        #the table is shared by all instances
+        if BandModel._lwtable is None:
+            BandModel._lwtable = lwtable()
+        self._sw = np.array(_swgpoints)
+
+    def radiation(self, atms, cparm, lwparm, swparm):
+        """
+        Calculates multi-band radiation.
+
+        Expects an Atmosphere (or AtmosphereBatch) object with the following
+        variables (size):
+            play (n)
+            plev (n+1)
+            tlay (n)
+            atms.tsfc
+            qlay (n)
+            o3lay (n)
+        Expects a ChemParm object with the following scalars:
+            co2ppmv
+        Expects a LWParm object with the following scalars:
+            emis
+        Expects a SWParm object with the following scalars:
+            albedo
+            fday
+            coszen
+            scon
+
+        Returns a Flux object with short and longwave fluxes
+        """
+        dmass = (c.mb2pa/c.grav)*np.diff(atms.plev)
+        h2o = atms.qlay*dmass
+        co2 = np.broadcast_to(self._co2mmr*cparm['co2ppmv']*dmass,
+                              np.shape(atms.tlay))
+        o3 = atms.o3lay*dmass
+
+        fuir, fdir = self._longwave(atms, h2o, co2, o3, lwparm['emis'])
+        fusw, fdsw = self._shortwave(atms, h2o, co2, o3, swparm)
+        return Flux(fuir, fdir, fusw, fdsw)
+
+    def _longwave(self, atms, h2o, co2, o3, emis):
+        """
+        LW fluxes summed over g-points, which run along a new leading axis.
+        """
+        table = self._lwtable
+        amount = {}
+        for gas, path in (('h2o', h2o), ('co2', co2), ('o3', o3)):
+            amount[gas] = path*(np.maximum(atms.play, _pdoppler)/_pref[gas])
+
+        #self continuum, proportional to the vapor pressure (atm)
+        e = atms.play*atms.qlay/(c.eps + (1.0-c.eps)*atms.qlay)/1013.25
+        amount['self'] = h2o*e*np.exp(_tself*(1.0/atms.tlay - 1.0/296.0))
+
+        k = dict(table['k'], self=table['kself'])
+        dtau = sum(np.multiply.outer(k[name], amount[name])
+                   for name in ('h2o', 'co2', 'o3', 'self'))
+
+        blay = self._planckfrac(atms.tlay)*(sigma*atms.tlay**4)
+        bsfc = self._planckfrac(atms.tsfc)*(sigma*np.power(atms.tsfc, 4))
+        fu, fd = sourcefluxes(diffusivity*dtau, blay, bsfc, emis)
+        return np.sum(fu, axis=0), np.sum(fd, axis=0)
+
+    def _shortwave(self, atms, h2o, co2, o3, swparm):
+        """
+        SW fluxes summed over g-points, which run along a new leading axis.
+        """
+        frac, kh2o, kco2, ko3 = self._sw.T
+        pscale = atms.play/_swpref
+        dtau = (np.multiply.outer(kh2o, h2o*pscale)
+                + np.multiply.outer(kco2, co2*pscale)
+                + np.multiply.outer(ko3, o3))
+
+        s0 = swparm['scon']*swparm['coszen']*swparm['fday']
+        s0 = (s0*frac).reshape((-1,) + (1,)*np.ndim(atms.tlay))
+        fu, fd = swfluxes(dtau, s0, swparm['coszen'], swparm['albedo'])
+        return np.sum(fu, axis=0), np.sum(fd, axis=0)
+
+    def _planckfrac(self, t):
+        """
+        Planck fractions of the LW g-points at temperatures t, (ng,)+shape.
+        """
+        x = np.clip(np.asarray(t, dtype=float) - _tgrid[0], 0.0,
+                    len(_tgrid) - 1.000001)
+        i = x.astype(int)
+        w = x - i
+        frac = self._lwtable['frac']
+        return frac[:,i]*(1.0-w) + frac[:,i+1]*w
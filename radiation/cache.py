@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Result cache for radiation models.
+"""
+
+__all__ = ['CachedRadModel']
+
+
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from radiation.radiation import RadModel, Flux, _column
+from radiation.factory import RadModelFactory
+
+
+def _hashvalue(h, value):
+    """
+    Add a setting or parameter value to hash h: numbers by their binary
+    value (independent of numpy print options), anything else by repr.
+    """
+    try:
+        if value is None:
+            raise TypeError
+        value = np.asarray(value, dtype=float)
+    except (TypeError, ValueError):
+        h.update(repr(value).encode())
+    else:
+        h.update(repr(value.shape).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+
+
+def _hashmodel(h, radmodel):
+    """Add the class and settings of radmodel (and what it wraps) to h."""
+    cls = type(radmodel)
+    h.update('{}.{}'.format(cls.__module__, cls.__qualname__).encode())
+    for name in radmodel._settings:
+        h.update(name.encode())
+        _hashvalue(h, getattr(radmodel, name))
+    inner = getattr(radmodel, 'radmodel', None)
+    if isinstance(inner, RadModel):
+        _hashmodel(h, inner)
+
+
+class CachedRadModel(RadModel):
+    """
+    Caching wrapper around any RadModel.
+
+    The state passed to radiation() is quantized (T and tsfc to ttol K, q and
+    o3 to a relative precision of qtol) and hashed together with the grid and
+    the ChemParm/LWParm/SWParm values and the identity of the wrapped model:
+    its class and the values of its _settings (recursively for wrapped
+    models such as LinearizedRadModel), plus modelkey if given, e.g. to tell
+    builds of a compiled code apart. Level and layer values are both
+    hashed, since the models read either (with gridstagger the layer values
+    are not interpolated from the levels). A state that hashes to a stored key
+    returns the stored Flux without calling the wrapped model. Results live
+    in a bounded in-memory LRU and, if cachedir is given, as .npy files in
+    that directory, which persist across runs.
+
+    Hits and misses are counted in self.hits (of which self.diskhits were
+    found on disk) and self.misses.
+    """
+
+    _cachesize = 256
+    _ttol = 1.0e-3
+    _qtol = 1.0e-3
+    #mixing ratios below this are treated as equal
+    _qmin = 1.0e-30
+
+    def __init__(self, radmodel=None, cachesize=None, ttol=None, qtol=None,
+                 cachedir=None, modelkey=None, **kwargs):
+        """
+        radmodel is a RadModel object, or a RadModelFactory name that is
+        created with the remaining keyword arguments.
+        """
+        print('initializing {} object'.format(self.__class__.__name__))
+        if isinstance(radmodel, RadModel):
+            self.radmodel = radmodel
+        else:
+            self.radmodel = RadModelFactory.create(radmodel, **kwargs)
+
+        if cachesize is not None:
+            self._cachesize = cachesize
+        if ttol is not None:
+            self._ttol = ttol
+        if qtol is not None:
+            self._qtol = qtol
+        self.cachedir = cachedir
+        h = hashlib.sha1()
+        _hashmodel(h, self.radmodel)
+        h.update(repr(modelkey).encode())
+        self._modelkey = h.digest()
+        if cachedir is not None:
+            os.makedirs(cachedir, exist_ok=True)
+
+        self._lru = OrderedDict()
+        self.hits = 0
+        self.diskhits = 0
+        self.misses = 0
+
+    def radiation(self, atms, cparm, lwparm, swparm):
+        """
+        Radiation from the cache, or from the wrapped model on a miss.
+        """
+        key = self.statekey(atms, cparm, lwparm, swparm)
+        flx = self._lookup(key)
+        if flx is None:
+            flx = self.radmodel.radiation(atms, cparm, lwparm, swparm)
+            self._store(key, flx)
+        return flx
+
+    def _radiation_group(self, atms, icols, cparm, lwparm, swparm):
+        """
+        Cached columns are looked up; the rest go to the wrapped model in
+        one radiation_batch call.
+        """
+        columns = [_column(atms, icol) for icol in icols]
+        keys = [self.statekey(col, cparm, lwparm, swparm) for col in columns]
+        flxs = [self._lookup(key) for key in keys]
+
+        imiss = [i for i, flx in enumerate(flxs) if flx is None]
+        if imiss:
+            new = self.radmodel.radiation_batch(
+                [columns[i] for i in imiss], cparm, lwparm, swparm)
+            for i, flx in zip(imiss, new):
+                self._store(keys[i], flx)
+                flxs[i] = flx
+        return flxs
+
+    def statekey(self, atms, cparm, lwparm, swparm):
+        """
+        Hash of the quantized state and parameters (hex string).
+        """
+        h = hashlib.sha1(self._modelkey)
+        h.update(repr((atms.gridstagger, np.shape(atms.tlev))).encode())
+        h.update(np.ascontiguousarray(atms.plev).tobytes())
+        h.update(np.ascontiguousarray(atms.play).tobytes())
+
+        tinv = 1.0/self._ttol
+        for t in (atms.tlev, atms.tlay, atms.tsfc):
+            h.update(np.rint(np.multiply(t, tinv)).astype(np.int64).tobytes())
+        qinv = 1.0/self._qtol
+        for q in (atms.qlev, atms.qlay, atms.o3lev, atms.o3lay):
+            logq = np.log(np.maximum(q, self._qmin))
+            h.update(np.rint(logq*qinv).astype(np.int64).tobytes())
+
+        for parm in (cparm, lwparm, swparm):
+            for name, value in sorted(parm.items()):
+                h.update(name.encode())
+                _hashvalue(h, value)
+        return h.hexdigest()
+
+    def _lookup(self, key):
+        """Cached Flux for key, or None."""
+        try:
+            data = self._lru.pop(key)
+        except KeyError:
+            data = self._loaddisk(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.diskhits += 1
+            self._remember(key, data)
+        else:
+            self._lru[key] = data
+        self.hits += 1
+        return Flux(*data)
+
+    def _store(self, key, flx):
+        data = np.stack((flx._fuir, flx._fdir, flx._fusw, flx._fdsw))
+        data.flags.writeable = False
+        self._remember(key, data)
+        if self.cachedir is not None:
+            #write to a temporary file and rename, so that concurrent
+            #readers never see a partial file
+            try:
+                fd, tmpname = tempfile.mkstemp(dir=self.cachedir,
+                                               prefix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        np.save(f, data)
+                    os.replace(tmpname, self._diskname(key))
+                except OSError:
+                    os.remove(tmpname)
+                    raise
+            except OSError:
+                pass
+
+    def _remember(self, key, data):
+        if len(self._lru) >= self._cachesize:
+            self._lru.popitem(last=False)
+        self._lru[key] = data
+
+    def _diskname(self, key):
+        return os.path.join(self.cachedir, key + '.npy')
+
+    def _loaddisk(self, key):
+        if self.cachedir is None:
+            return None
+        try:
+            data = np.load(self._diskname(key))
+        except (OSError, ValueError, EOFError):
+            return None
+        data.flags.writeable = False
+        return data
+
+    def clearcache(self):
+        """Empty the in-memory cache and reset the counters."""
+        self._lru.clear()
+        self.hits = 0
+        self.diskhits = 0
+        self.misses = 0
@@ -18,11 +18,24 @@ class RadModelFactory(object):
     Factory specifications for RadModel type objects
     """
     #import defined classes here. Should be at same package level as factory
-    from radiation.rrtmg import RRTMGModel
-    from radiation.fu import FuModel
+    from radiation.gray import GrayModel, SemiGrayModel
+    from radiation.bands import BandModel
 
     #add dictionary listings for new models. String keys should be lower case
-    _classnames = {'rrtmg':RRTMGModel,'fu':FuModel}
+    _classnames = {'gray':GrayModel,'semigray':SemiGrayModel,
+                   'bands':BandModel}
+
+    #models wrapping compiled codes are only listed if their submodule is built
+    try:
+        from radiation.rrtmg import RRTMGModel
+        _classnames['rrtmg'] = RRTMGModel
+    except ImportError as err:
+        print('RadModelFactory: rrtmg unavailable ({})'.format(err))
+    try:
+        from radiation.fu import FuModel
+        _classnames['fu'] = FuModel
+    except ImportError as err:
+        print('RadModelFactory: fu unavailable ({})'.format(err))
 
     @classmethod
     def create(cls,radmodel=None,*args,**kwargs):
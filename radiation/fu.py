@@ -20,11 +20,18 @@ class FuModel(RadModel):
     Class construct for pyrrtmg
     """
 
-    def __init__(self,**kwargs):
+    def __init__(self,packed=False,**kwargs):
+        """
+        Set packed=True only if fupy was built with a column dimension; then
+        radiation_batch passes an AtmosphereBatch in one call. The stock
+        single-column build is called once per column.
+        """
 
         print('ititializing fu object')
         fupy.init()
 
+        self._packed = packed
+
     def radiation(self,atms,cparm,lwparm, swparm):
         """
         Calculates Fu radiation.
@@ -52,17 +59,26 @@ class FuModel(RadModel):
             coszen
             scon
 
+        An AtmosphereBatch is passed as (ncol, n) arrays in one call, which
+        requires fupy built with a column dimension (see packed).
+
         Returns a Flux object with short and longwave fluxes
         """
-        fuir = np.empty(len(atms.plev))
-        fdir = np.empty(len(atms.plev))
-        fusw = np.empty(len(atms.plev))
-        fdsw = np.empty(len(atms.plev))
+        fuir = np.empty(np.shape(atms.tlev))
+        fdir = np.empty(np.shape(atms.tlev))
+        fusw = np.empty(np.shape(atms.tlev))
+        fdsw = np.empty(np.shape(atms.tlev))
 
         # flip indices, since rrtm expects pressure to decrease with index,
         # while the Atmosphere class expects pressure to increase with index.
+        plev = atms.plev
+        if np.ndim(atms.tlev) > 1:
+            #the pressure grid is shared; f2py needs a writable full array
+            plev = np.ascontiguousarray(
+                np.broadcast_to(plev, np.shape(atms.tlev)))
         (fuir, fdir, fusw, fdsw) = fupy.rad(
-            atms.plev, atms.tlev, atms.tsfc,
+            plev, atms.tlev,
+            atms.tsfc,
             atms.qlev, atms.o3lev, **cparm, **lwparm,**swparm
             )
 
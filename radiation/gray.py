@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Class definitions for gray and semi-gray radiation in the RCE model.
+
+Pure NumPy two-stream models that need no compiled radiation code. They are
+fast surrogates for exploration and testing, not a replacement for RRTMG.
+"""
+
+__all__ = ['GrayModel', 'SemiGrayModel']
+
+
+from radiation.radiation import RadModel, Flux
+import atmosphere.constants as c
+import numpy as np
+
+
+#Stefan-Boltzmann constant (W m-2 K-4) and LW diffusivity factor
+sigma = 5.670367e-8
+diffusivity = 1.66
+
+
+def lwfluxes(dtau, tlay, tsfc, emis):
+    """
+    Upward and downward LW fluxes for absorbing, non-scattering layers.
+
+    dtau holds the (diffuse) layer optical depths and tlay the layer
+    temperatures, both (..., nlay) with index 0 at the top; tsfc and emis
+    broadcast against the leading axes. Each layer emits as a black body at
+    its own temperature. Returns (fu, fd), (..., nlay+1).
+    """
+    return sourcefluxes(dtau, sigma*tlay**4, sigma*tsfc**4, emis)
+
+
+def sourcefluxes(dtau, blay, bsfc, emis):
+    """
+    LW fluxes for layers with emission blay and a surface with emission bsfc.
+
+    As lwfluxes, but with the (spectrally integrated) Planck fluxes of the
+    layers and the surface given directly, e.g. for one band. The two-stream
+    recursions are evaluated in closed form with cumulative sums in log
+    space, so they are vectorized along the levels and safe for any optical
+    depth. Returns (fu, fd), (..., nlay+1).
+    """
+    tau = np.zeros(np.shape(dtau)[:-1] + (np.shape(dtau)[-1]+1,))
+    np.cumsum(dtau, axis=-1, out=tau[...,1:])
+
+    with np.errstate(divide='ignore'):
+        logsrc = np.log(blay*(-np.expm1(-dtau)))
+
+        #down: fd_i = sum_{k<i} src_k exp(-(tau_i - tau_{k+1}))
+        fd = np.zeros(np.shape(tau))
+        fd[...,1:] = np.exp(
+            np.logaddexp.accumulate(logsrc + tau[...,1:], axis=-1)
+            - tau[...,1:])
+
+        #up: fu_i = fu_sfc exp(-(tau_n - tau_i))
+        #           + sum_{k>=i} src_k exp(-(tau_k - tau_i))
+        fusfc = emis*bsfc + (1.0-emis)*fd[...,-1]
+        terms = np.empty(np.shape(tau))
+        terms[...,:-1] = logsrc - tau[...,:-1]
+        terms[...,-1] = np.log(fusfc) - tau[...,-1]
+        fu = np.exp(
+            np.logaddexp.accumulate(terms[...,::-1], axis=-1)[...,::-1] + tau)
+
+    return fu, fd
+
+
+def swfluxes(dtau, s0, mu, albedo):
+    """
+    Upward and downward SW fluxes for absorbing, non-scattering layers.
+
+    The direct beam (s0 at the top, cosine of zenith angle mu) is attenuated
+    by the layer optical depths dtau (..., nlay), reflected at the surface
+    with the given albedo and then attenuated as diffuse radiation on its way
+    up. Returns (fu, fd), (..., nlay+1).
+    """
+    tau = np.zeros(np.shape(dtau)[:-1] + (np.shape(dtau)[-1]+1,))
+    np.cumsum(dtau, axis=-1, out=tau[...,1:])
+
+    fd = np.multiply(s0, np.exp(-tau/mu))
+    fu = np.multiply(albedo*fd[...,-1:],
+                     np.exp(-diffusivity*(tau[...,-1:]-tau)))
+    return fu, fd
+
+
+class GrayModel(RadModel):
+    """
+    Gray two-stream radiation model.
+
+    LW optical depth grows with pressure as taulw*(p/ps)**nlw, SW optical
+    depth as tausw*(p/ps), independent of the atmospheric composition.
+    """
+
+    _packed = True
+    _settings = ('taulw', 'nlw', 'tausw')
+    taulw = 4.0
+    nlw = 4.0
+    tausw = 0.2
+
+    def __init__(self, taulw=None, nlw=None, tausw=None, **kwargs):
+        print('initializing {} object'.format(self.__class__.__name__))
+        if taulw is not None:
+            self.taulw = taulw
+        if nlw is not None:
+            self.nlw = nlw
+        if tausw is not None:
+            self.tausw = tausw
+
+    def radiation(self, atms, cparm, lwparm, swparm):
+        """
+        Calculates gray radiation.
+
+        Expects an Atmosphere (or AtmosphereBatch) object with the following
+        variables (size):
+            plev (n+1)
+            tlay (n)
+            atms.tsfc
+        plus qlay (n) and o3lay (n) for the semi-gray model.
+        Expects a ChemParm object (semi-gray model only):
+            co2ppmv
+        Expects a LWParm object with the following scalars:
+            emis
+        Expects a SWParm object with the following scalars:
+            albedo
+            fday
+            coszen
+            scon
+
+        Returns a Flux object with short and longwave fluxes
+        """
+        shape = np.shape(atms.tlay)
+        fuir, fdir = lwfluxes(
+            diffusivity*np.broadcast_to(self._dtaulw(atms, cparm), shape),
+            atms.tlay, atms.tsfc, lwparm['emis'])
+
+        s0 = swparm['scon']*swparm['coszen']*swparm['fday']
+        fusw, fdsw = swfluxes(
+            np.broadcast_to(self._dtausw(atms, cparm), shape), s0,
+            swparm['coszen'], swparm['albedo'])
+
+        return Flux(fuir, fdir, fusw, fdsw)
+
+    def _dtaulw(self, atms, cparm):
+        """LW layer optical depths."""
+        return np.diff(self.taulw*(atms.plev/atms.plev[-1])**self.nlw)
+
+    def _dtausw(self, atms, cparm):
+        """SW layer optical depths."""
+        return np.diff(self.tausw*(atms.plev/atms.plev[-1]))
+
+
+class SemiGrayModel(GrayModel):
+    """
+    Semi-gray two-stream radiation model.
+
+    Separate LW and SW optical depths are tied to the absorbers: LW to water
+    vapor (qlay) and CO2 (ChemParm co2ppmv), with linear pressure broadening,
+    and SW to water vapor and ozone (o3lay). Absorption coefficients are mass
+    absorption coefficients in m2 kg-1.
+    """
+
+    _settings = GrayModel._settings + ('klw_h2o', 'klw_co2', 'ksw_h2o',
+                                       'ksw_o3')
+    klw_h2o = 0.1
+    klw_co2 = 0.06
+    ksw_h2o = 0.002
+    ksw_o3 = 20.0
+    #CO2 mass mixing ratio per ppmv
+    _co2mmr = 1.0e-6*44.01/c.Md
+
+    def __init__(self, klw_h2o=None, klw_co2=None, ksw_h2o=None,
+                 ksw_o3=None, **kwargs):
+        super().__init__(**kwargs)
+        if klw_h2o is not None:
+            self.klw_h2o = klw_h2o
+        if klw_co2 is not None:
+            self.klw_co2 = klw_co2
+        if ksw_h2o is not None:
+            self.ksw_h2o = ksw_h2o
+        if ksw_o3 is not None:
+            self.ksw_o3 = ksw_o3
+
+    @staticmethod
+    def _dmass(atms):
+        """Layer mass per unit area (kg m-2)."""
+        return (c.mb2pa/c.grav)*np.diff(atms.plev)
+
+    def _dtaulw(self, atms, cparm):
+        kappa = (self.klw_h2o*atms.qlay
+                 + self.klw_co2*self._co2mmr*cparm['co2ppmv'])
+        return kappa*(atms.play/atms.plev[-1])*self._dmass(atms)
+
+    def _dtausw(self, atms, cparm):
+        kappa = self.ksw_h2o*atms.qlay + self.ksw_o3*atms.o3lay
+        return kappa*self._dmass(atms)
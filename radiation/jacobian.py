@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Finite-difference Jacobians of radiative responses with respect to the
+temperature profile, from batched radiation calls.
+"""
+
+__all__ = ['BandedJacobian', 'bandedjacobian', 'perturbationjacobian',
+           'jacobiancolumns']
+
+
+import numpy as np
+from scipy.linalg import solve_banded
+
+
+#default temperature perturbation (K) for finite differences
+_delta = 0.1
+
+
+def jacobiancolumns(n, band=2, nsmooth=0):
+    """
+    Number of columns perturbationjacobian evaluates for n levels, including
+    the unperturbed one.
+    """
+    if band is None:
+        return n + 2
+    return min(2*band+1, n) + nsmooth + 2
+
+
+def _bandindex(band, nout, n):
+    """
+    Indices (d, i, j) of the entries of a (nout, n) matrix within band,
+    which is stored as ab[..., band+i-j, j] = a[..., i, j].
+    """
+    d, j = np.nonzero(np.ones((2*band+1, n), dtype=bool))
+    i = j + d - band
+    valid = (i >= 0) & (i < nout)
+    return d[valid], i[valid], j[valid]
+
+
+def _bandeddot(ab, band, nout, x):
+    """
+    Product of the (nout, n) banded matrix ab with x, of shape (n,) or
+    (n, k), in 2*band+1 vectorized steps.
+    """
+    n = ab.shape[-1]
+    x = np.asarray(x)
+    trail = (slice(None),)*(x.ndim-1)
+    y = np.zeros(ab.shape[:-2] + (nout,) + x.shape[1:])
+    for off in range(-band, band+1):
+        #rows i whose column j = i+off exists
+        lo, hi = max(0, -off), min(nout, n-off)
+        if hi <= lo:
+            continue
+        a = ab[...,band-off,lo+off:hi+off]
+        y[(Ellipsis, slice(lo, hi)) + trail] += (
+            a[(Ellipsis,) + (np.newaxis,)*(x.ndim-1)]*x[lo+off:hi+off])
+    return y
+
+
+class BandedJacobian(object):
+    """
+    Jacobian of a response (..., nout) with respect to (t, tsfc), n+1
+    unknowns, in structured form:
+
+        J = B + u v + c e_tsfc
+
+    B is banded with half width band and stored by diagonals, ab[...,
+    band+i-j, j] = B[..., i, j] (the layout of scipy.linalg.solve_banded),
+    u (..., nout, k) and v (k, n) are the low-rank smooth correction (None
+    without one), and c (..., nout) is the tsfc column. Applying J costs
+    O(nout*(band+k)) instead of O(nout*n).
+    """
+
+    def __init__(self, ab, band, nout, tsfc, u=None, v=None):
+        self.ab = ab
+        self.band = band
+        self.nout = nout
+        self.tsfc = tsfc
+        self.u = u
+        self.v = v
+
+    @property
+    def n(self):
+        return self.ab.shape[-1]
+
+    def dot(self, dx):
+        """J times the change dx of (t, tsfc)."""
+        x = dx[:-1]
+        y = _bandeddot(self.ab, self.band, self.nout, x) + self.tsfc*dx[-1]
+        if self.u is not None:
+            y += np.dot(self.u, np.dot(self.v, x))
+        return y
+
+    def diagonal(self):
+        """Diagonal of the t part of J, (..., min(nout, n))."""
+        m = min(self.nout, self.n)
+        diag = self.ab[...,self.band,:m].copy()
+        if self.u is not None:
+            diag += np.sum(self.u[...,:m,:]*self.v[:,:m].T, axis=-1)
+        return diag
+
+    def implicitsolve(self, f, dt):
+        """
+        Solve the backward Euler system (I - diag(dt) J) dx = dt f for a
+        single response (nout = n or n+1, the last one answering to tsfc);
+        entries with dt = 0 are held (dx = 0). With f of length n the tsfc
+        column is left out.
+
+        The t block is banded apart from u v: solve_banded handles the band
+        and the Woodbury identity the rank-k part, with all right-hand sides
+        in one banded solve. The tsfc row and column border the t block and
+        are eliminated through its Schur complement.
+        """
+        n, band = self.n, self.band
+        m = len(f)
+        #row of each band entry; the rows beyond the t block are dropped
+        i = np.arange(n) + np.arange(-band, band+1)[:,np.newaxis]
+        ab = -self.ab*np.where(i < n, dt[np.clip(i, 0, n-1)], 0.0)
+        ab[band] += 1.0
+
+        dtt = dt[:n,np.newaxis]
+        rhs = [dtt*f[:n,np.newaxis]]
+        if m > n:
+            rhs.append(-dtt*self.tsfc[:n,np.newaxis])
+        if self.u is not None:
+            rhs.append(-dtt*self.u[:n])
+        z = solve_banded((band, band), ab, np.hstack(rhs))
+        w = z[:,:m-n+1]
+        if self.u is not None:
+            #(M - u v)^-1 w = M^-1 w + M^-1 u (I - v M^-1 u)^-1 v M^-1 w
+            zu = -z[:,m-n+1:]
+            cap = np.eye(zu.shape[1]) - np.dot(self.v, zu)
+            w = w + np.dot(zu, np.linalg.solve(cap, np.dot(self.v, w)))
+        if m == n:
+            return w[:,0]
+
+        #tsfc row of -J on the t unknowns
+        row = np.zeros(n)
+        cols = np.arange(max(0, n-band), n)
+        row[cols] = -self.ab[band+n-cols,cols]
+        if self.u is not None:
+            row -= np.dot(self.u[n], self.v)
+        row *= dt[n]
+        dxs = ((dt[n]*f[n] - np.dot(row, w[:,0]))
+               /(1.0 - dt[n]*self.tsfc[n] - np.dot(row, w[:,1])))
+        return np.append(w[:,0] - w[:,1]*dxs, dxs)
+
+    def todense(self):
+        """J as a dense (..., nout, n+1) array."""
+        n = self.n
+        jac = np.zeros(self.ab.shape[:-2] + (self.nout, n+1))
+        d, i, j = _bandindex(self.band, self.nout, n)
+        jac[...,i,j] = self.ab[...,d,j]
+        if self.u is not None:
+            jac[...,:n] += np.dot(self.u, self.v)
+        jac[...,n] = self.tsfc
+        return jac
+
+
+def bandedjacobian(radmodel, atms, cparm, lwparm, swparm, response,
+                   band=2, nsmooth=0, delta=None):
+    """
+    Finite-difference Jacobian of response(atms, flx) with respect to the
+    native-grid temperature atms.t and tsfc, as a BandedJacobian.
+
+    response returns an array whose last axis lines up with atms.t, possibly
+    followed by further entries (such as a tsfc tendency), which are treated
+    as a continuation of the band. Perturbed atmospheres are independent
+    clones of atms (changes in t propagate to the other grid and, with
+    holdrh, to q), and all of them go to radmodel.radiation_batch in one
+    call.
+
+    With band=b (default 2) the response at index k is assumed to depend
+    only on t within k-b..k+b (cooling to space plus exchange with nearby
+    layers); levels 2b+1 apart are then perturbed together, so the banded
+    part costs 2b+3 columns. With band=None every level is perturbed
+    separately (len(t)+2 columns), which for models that loop over columns
+    costs about as many radiation calls as there are levels; see
+    jacobiancolumns. The exchange with distant layers (e.g. absorption of
+    upwelling radiation from the lower troposphere) is missed by the band;
+    nsmooth > 0 adds that many smooth (cosine) perturbations of the whole
+    profile and a rank-nsmooth correction that reproduces their responses
+    exactly, which recovers most of the far field for smooth temperature
+    changes.
+
+    Returns (r0, jac): the response at atms and its Jacobian.
+    """
+    if delta is None:
+        delta = _delta
+    t0 = atms.t.copy()
+    n = len(t0)
+    if band is None:
+        nsmooth = 0
+    stride = n if band is None else min(2*band+1, n)
+    basis = np.cos(np.pi*np.outer(np.arange(n)+0.5, np.arange(nsmooth))/n)
+
+    columns = [atms]
+    for c in range(stride):
+        pert = atms.clone()
+        dt = np.zeros(n)
+        dt[c::stride] = delta
+        pert.t = t0 + dt
+        columns.append(pert)
+    for dt in delta*basis.T:
+        pert = atms.clone()
+        pert.t = t0 + dt
+        columns.append(pert)
+    pert = atms.clone()
+    pert.tsfc = atms.tsfc + delta
+    columns.append(pert)
+
+    flxs = radmodel.radiation_batch(columns, cparm, lwparm, swparm)
+    resp = [np.asarray(response(col, flx)) for col, flx in zip(columns, flxs)]
+
+    r0 = resp[0]
+    nout = r0.shape[-1]
+    if band is None:
+        band = max(n, nout) - 1
+    #responses to the perturbation of each group of levels, (..., group, i)
+    groups = (np.stack(resp[1:stride+1], axis=-2) - r0[...,np.newaxis,:]
+              )/delta
+    ab = np.zeros(r0.shape[:-1] + (2*band+1, n))
+    d, i, j = _bandindex(band, nout, n)
+    ab[...,d,j] = groups[...,j % stride,i]
+    tsfc = (resp[-1] - r0)/delta
+
+    u = v = None
+    if nsmooth:
+        smooth = np.stack(resp[stride+1:-1], axis=-1)
+        smooth = (smooth - r0[...,np.newaxis])/delta
+        u = smooth - _bandeddot(ab, band, nout, basis)
+        v = np.linalg.pinv(basis)
+    return r0, BandedJacobian(ab, band, nout, tsfc, u, v)
+
+
+def perturbationjacobian(radmodel, atms, cparm, lwparm, swparm, response,
+                         band=2, nsmooth=0, delta=None):
+    """
+    The Jacobian of bandedjacobian as a dense array.
+
+    Returns (r0, jac): the response at atms and its Jacobian, with shape
+    r0.shape + (len(t)+1,); the last column is the tsfc derivative.
+    """
+    r0, jac = bandedjacobian(radmodel, atms, cparm, lwparm, swparm,
+                             response, band=band, nsmooth=nsmooth,
+                             delta=delta)
+    return r0, jac.todense()
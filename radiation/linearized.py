@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Linearized radiation between full radiation calls.
+"""
+
+__all__ = ['LinearizedRadModel']
+
+
+import numpy as np
+
+from radiation.radiation import RadModel, Flux, _parmkey
+from radiation.factory import RadModelFactory
+from radiation.jacobian import bandedjacobian, jacobiancolumns
+
+
+def _fluxdiffs(atms, flx):
+    """
+    Fluxes as layer differences plus the surface value, (4, nlev).
+
+    The difference across a layer is the part of the flux that depends on
+    nearby temperatures only, which is what makes a banded Jacobian of it a
+    good approximation. The fluxes are recovered by _fromfluxdiffs.
+    """
+    f = np.stack((flx._fuir, flx._fdir, flx._fusw, flx._fdsw))
+    g = np.empty(np.shape(f))
+    g[:,:-1] = f[:,:-1] - f[:,1:]
+    g[:,-1] = f[:,-1]
+    return g
+
+
+def _fromfluxdiffs(g):
+    return Flux(*np.cumsum(g[:,::-1], axis=-1)[:,::-1])
+
+
+class LinearizedRadModel(RadModel):
+    """
+    RadModel decorator that linearizes the fluxes between full calls.
+
+    A full radiation call is made every interval calls, or earlier if any
+    temperature (or tsfc) moved more than tthresh since the last one, or the
+    ozone, the parameters or the grid changed (or q, unless it is tied to T
+    by holdrh). The flux Jacobian with respect to t and tsfc is rebuilt at
+    every jacinterval-th full call. It is banded (band, default _band, see
+    bandedjacobian), with a rank-nsmooth correction from smooth profile
+    perturbations (default 8) for the far-field exchange, and is kept and
+    applied in that form, so a linear call costs O(n*(band+nsmooth));
+    dense=True builds the dense Jacobian instead, at len(t)+2 columns per
+    rebuild and O(n**2) per linear call.
+
+    lastexact tells whether the last result came from a full call, and
+    fullcalls, jaccalls and linearcalls count the calls of each kind.
+    columns counts the columns the wrapped model computed, full calls and
+    Jacobian columns together, which is the cost to compare with plain
+    radiation calls.
+    """
+
+    _settings = ('_interval', '_jacinterval', '_band', '_nsmooth', '_tthresh',
+                 '_qrtol', 'dense', 'delta')
+    _interval = 10
+    _jacinterval = 5
+    _band = 2
+    _nsmooth = 8
+    _tthresh = 2.0
+    #relative change in q or o3 that forces a full call
+    _qrtol = 1.0e-3
+
+    def __init__(self, radmodel=None, interval=None, jacinterval=None,
+                 tthresh=None, band=None, nsmooth=None, delta=None,
+                 dense=False, **kwargs):
+        """
+        radmodel is a RadModel object, or a RadModelFactory name that is
+        created with the remaining keyword arguments.
+        """
+        print('initializing {} object'.format(self.__class__.__name__))
+        if isinstance(radmodel, RadModel):
+            self.radmodel = radmodel
+        else:
+            self.radmodel = RadModelFactory.create(radmodel, **kwargs)
+
+        if interval is not None:
+            self._interval = interval
+        if jacinterval is not None:
+            self._jacinterval = jacinterval
+        if tthresh is not None:
+            self._tthresh = tthresh
+        if nsmooth is not None:
+            self._nsmooth = nsmooth
+        if band is not None:
+            self._band = band
+        self.dense = dense
+        self.delta = delta
+
+        self._ref = None
+        self.lastexact = True
+        self.fullcalls = 0
+        self.jaccalls = 0
+        self.linearcalls = 0
+        self.columns = 0
+
+    def radiation(self, atms, cparm, lwparm, swparm):
+        """
+        Full or linearized radiation, following the refresh rules.
+        """
+        ref = self._ref
+        key = self._parmkey(atms, cparm, lwparm, swparm)
+        if (ref is None or ref['key'] != key
+                or ref['ncall'] >= self._interval
+                or self._drifted(atms)):
+            return self._refresh(atms, cparm, lwparm, swparm, key)
+
+        dx = np.append(atms.t - ref['t'], atms.tsfc - ref['tsfc'])
+        ref['ncall'] += 1
+        self.linearcalls += 1
+        self.lastexact = False
+        return _fromfluxdiffs(ref['g'] + ref['jac'].dot(dx))
+
+    def radiation_batch(self, atms, cparm, lwparm, swparm):
+        """
+        Columns are not linearized; they go to the wrapped model directly.
+        """
+        self.lastexact = True
+        flxs = self.radmodel.radiation_batch(atms, cparm, lwparm, swparm)
+        self.columns += len(flxs) if isinstance(flxs, list) else atms.ncol
+        return flxs
+
+    def _refresh(self, atms, cparm, lwparm, swparm, key):
+        """
+        Full call at atms; rebuild the Jacobian if it is due.
+        """
+        ref = self._ref
+        if (ref is None or ref['key'] != key
+                or ref['nfull'] >= self._jacinterval):
+            band = None if self.dense else self._band
+            g, jac = bandedjacobian(
+                self.radmodel, atms, cparm, lwparm, swparm, _fluxdiffs,
+                band=band, nsmooth=self._nsmooth, delta=self.delta)
+            nfull = 0
+            self.jaccalls += 1
+            self.columns += jacobiancolumns(len(atms.t), band, self._nsmooth)
+        else:
+            g = _fluxdiffs(atms, self.radmodel.radiation(
+                atms, cparm, lwparm, swparm))
+            jac = ref['jac']
+            nfull = ref['nfull']
+            self.columns += 1
+
+        self._ref = {'key': key, 'g': g, 'jac': jac, 'ncall': 0,
+                     'nfull': nfull+1, 't': atms.t.copy(),
+                     'tsfc': np.copy(atms.tsfc), 'q': atms.q.copy(),
+                     'o3': atms.o3.copy()}
+        self.fullcalls += 1
+        self.lastexact = True
+        return _fromfluxdiffs(g)
+
+    def _drifted(self, atms):
+        """
+        True if the state moved too far from the last full call.
+        """
+        ref = self._ref
+        if (np.max(np.abs(atms.t - ref['t'])) > self._tthresh
+                or abs(atms.tsfc - ref['tsfc']) > self._tthresh):
+            return True
+        if not np.allclose(atms.o3, ref['o3'], rtol=self._qrtol, atol=0.0):
+            return True
+        if not atms.holdrh:
+            return not np.allclose(atms.q, ref['q'], rtol=self._qrtol,
+                                   atol=0.0)
+        return False
+
+    @staticmethod
+    def _parmkey(atms, cparm, lwparm, swparm):
+        return (atms.gridstagger, atms.plev.tobytes(),
+                _parmkey(cparm, lwparm, swparm))
+
+    def reset(self):
+        """Drop the stored reference state and Jacobian."""
+        self._ref = None
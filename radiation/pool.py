@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pool of persistent radiation worker processes.
+"""
+
+__all__ = ['RadWorkerPool']
+
+
+import os
+import time
+
+from radiation.radiation import RadModel, Flux, _groupcolumns, _gridgroups
+from radiation.radiation import _column
+from radiation.factory import RadModelFactory
+from radiation.workers import SharedArrays, RadWorker, ready
+
+
+#radiation inputs of the Atmosphere interface, per column
+_levvars = ('tlev', 'qlev', 'o3lev')
+_layvars = ('tlay', 'qlay', 'o3lay')
+_fluxvars = ('_fuir', '_fdir', '_fusw', '_fdsw')
+
+
+class _Columns(object):
+    """
+    Radiation inputs of columns icol of a worker's buffers, as views.
+
+    Stands in for the Atmosphere object inside a worker: radiation models
+    only read these variables. icol is an index (one column) or a slice
+    (a batch on a shared grid).
+    """
+
+    def __init__(self, shared, nlev, icol):
+        self.plev = shared['plev'][:nlev]
+        self.play = shared['play'][:nlev-1]
+        for name in _levvars:
+            setattr(self, name, shared[name][icol,:nlev])
+        for name in _layvars:
+            setattr(self, name, shared[name][icol,:nlev-1])
+        self.tsfc = shared['tsfc'][icol]
+
+
+def _poolworker(conn, radmodel, kwargs, shared):
+    """
+    Serve RadWorkerPool requests in a worker process.
+
+    The radiation model is created once. A request (nlev, ncol, cparm,
+    lwparm, swparm) computes the first ncol columns of the shared inputs,
+    writes their fluxes to the shared outputs and is answered with the time
+    spent in the model.
+    """
+    try:
+        model = RadModelFactory.create(radmodel, **kwargs)
+    except Exception as err:
+        model = err
+
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        if isinstance(model, Exception):
+            conn.send(model)
+            continue
+        nlev, ncol, cparm, lwparm, swparm = msg
+        try:
+            st = time.perf_counter()
+            if model._packed and ncol > 1:
+                outputs = [(slice(0, ncol), model.radiation(
+                    _Columns(shared, nlev, slice(0, ncol)),
+                    cparm, lwparm, swparm))]
+            else:
+                outputs = [(icol, model.radiation(
+                    _Columns(shared, nlev, icol), cparm, lwparm, swparm))
+                    for icol in range(ncol)]
+            for icol, flx in outputs:
+                for name in _fluxvars:
+                    shared[name][icol,:nlev] = getattr(flx, name)
+            conn.send(time.perf_counter()-st)
+        except Exception as err:
+            conn.send(err)
+    conn.close()
+
+
+class RadWorkerPool(RadModel):
+    """
+    RadModel that spreads columns over persistent worker processes.
+
+    Each of the nworkers processes creates its own radiation model (a
+    RadModelFactory name, with the remaining keyword arguments) once, so
+    codes with global state such as rrtmg and fu are initialized once per
+    process and never shared between threads. Profiles and fluxes are
+    exchanged through shared memory; only the parameter objects are
+    pickled per request.
+
+    radiation_batch splits the columns of each parameter set and grid into
+    chunks of at most maxcols columns and hands them to the workers as they
+    become free, so both the columns of one batch and the members of a
+    parameter sweep run in parallel. A single column is passed to one
+    worker.
+
+    The shared buffers are sized for the largest grid seen so far; a larger
+    grid restarts the workers. close() stops them. The model time of the
+    workers and the wall time of the last call are kept in self.timings,
+    and running sums in self.timetotals.
+    """
+
+    _maxcols = 32
+
+    def __init__(self, radmodel=None, nworkers=None, maxcols=None, **kwargs):
+        print('initializing {} object'.format(self.__class__.__name__))
+        if radmodel is None or radmodel not in RadModelFactory._classnames:
+            estr = "{} needs a RadModelFactory name, not {}."
+            raise ValueError(estr.format(self.__class__.__name__, radmodel))
+        self.radmodel = radmodel
+        self._kwargs = kwargs
+        self.nworkers = nworkers if nworkers is not None else os.cpu_count()
+        if maxcols is not None:
+            self._maxcols = maxcols
+        print('{}: {} workers running {}'.format(
+              self.__class__.__name__, self.nworkers, radmodel))
+
+        self._workers = None
+        self._nlevmax = 0
+        self.timings = None
+        self.timetotals = {'work': 0.0, 'wall': 0.0, 'calls': 0}
+
+    def radiation(self, atms, cparm, lwparm, swparm):
+        """
+        Radiation for one Atmosphere (or AtmosphereBatch) in the workers.
+        """
+        if hasattr(atms, 'ncol'):
+            return self.radiation_batch(atms, cparm, lwparm, swparm)
+        return self.radiation_batch([atms], cparm, lwparm, swparm)[0]
+
+    def radiation_batch(self, atms, cparm, lwparm, swparm):
+        """
+        Radiation for many columns, fanned out over the workers.
+
+        Arguments and result are those of RadModel.radiation_batch.
+        """
+        st = time.perf_counter()
+        ncol = atms.ncol if hasattr(atms, 'ncol') else len(atms)
+        columns = [_column(atms, icol) for icol in range(ncol)]
+
+        chunks = []
+        for icols, cp, lp, sp in _groupcolumns(ncol, cparm, lwparm, swparm):
+            for gcols in _gridgroups(columns, icols):
+                size = -(-len(gcols)//self.nworkers)
+                size = min(max(size, 1), self._maxcols)
+                chunks.extend((gcols[i:i+size], cp, lp, sp)
+                              for i in range(0, len(gcols), size))
+
+        nlev = max(len(col.plev) for col in columns)
+        if self._workers is None or nlev > self._nlevmax:
+            self._start(nlev)
+
+        flxs = [None]*ncol
+        work = self._run(columns, chunks, flxs)
+        self.timings = {'work': work, 'wall': time.perf_counter()-st}
+        for key, value in self.timings.items():
+            self.timetotals[key] += value
+        self.timetotals['calls'] += 1
+
+        if hasattr(atms, 'ncol'):
+            return Flux.fromcolumns(flxs)
+        return flxs
+
+    def _run(self, columns, chunks, flxs):
+        """
+        Compute chunks of columns on the free workers until all are done.
+
+        Returns the summed model time of the workers.
+        """
+        pending = list(reversed(chunks))
+        free = list(self._workers)
+        busy = {}
+        work = 0.0
+        while pending or busy:
+            while pending and free:
+                worker = free.pop()
+                chunk = pending.pop()
+                self._send(worker, columns, chunk)
+                busy[worker] = chunk
+            for worker in ready(list(busy)):
+                chunk = busy.pop(worker)
+                try:
+                    work += worker.recv()
+                except Exception:
+                    #drain the other workers before giving up
+                    for other in busy:
+                        try:
+                            other.recv()
+                        except Exception:
+                            pass
+                    raise
+                self._collect(worker, chunk[0], flxs)
+                free.append(worker)
+        return work
+
+    def _send(self, worker, columns, chunk):
+        """Fill the worker's inputs with the chunk's columns and start it."""
+        icols, cparm, lwparm, swparm = chunk
+        shared = worker.shared
+        first = columns[icols[0]]
+        nlev = len(first.plev)
+        shared['plev'][:nlev] = first.plev
+        shared['play'][:nlev-1] = first.play
+        for j, icol in enumerate(icols):
+            col = columns[icol]
+            for name in _levvars:
+                shared[name][j,:nlev] = getattr(col, name)
+            for name in _layvars:
+                shared[name][j,:nlev-1] = getattr(col, name)
+            shared['tsfc'][j] = col.tsfc
+        worker.nlev = nlev
+        worker.send((nlev, len(icols), cparm, lwparm, swparm))
+
+    @staticmethod
+    def _collect(worker, icols, flxs):
+        """Copy the fluxes of a finished chunk out of the shared outputs."""
+        shared = worker.shared
+        nlev = worker.nlev
+        for j, icol in enumerate(icols):
+            flxs[icol] = Flux(*[shared[name][j,:nlev].copy()
+                                for name in _fluxvars])
+
+    def _start(self, nlev):
+        """
+        (Re)start the workers with shared buffers for up to nlev levels.
+
+        Shared memory can only be handed to a process when it starts.
+        """
+        self.close()
+        cap = self._maxcols
+        shapes = (('plev', (nlev,)), ('play', (nlev-1,)),
+                  ('tsfc', (cap,)))
+        shapes += tuple((name, (cap, nlev)) for name in _levvars)
+        shapes += tuple((name, (cap, nlev-1)) for name in _layvars)
+        shapes += tuple((name, (cap, nlev)) for name in _fluxvars)
+
+        self._workers = []
+        for i in range(self.nworkers):
+            shared = SharedArrays(shapes)
+            worker = RadWorker(_poolworker, self.radmodel, self._kwargs,
+                               shared)
+            worker.shared = shared
+            self._workers.append(worker)
+        self._nlevmax = nlev
+
+    def close(self):
+        """Stop the worker processes."""
+        if self._workers is not None:
+            for worker in self._workers:
+                worker.close()
+            self._workers = None
+            self._nlevmax = 0
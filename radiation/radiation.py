@@ -10,17 +10,184 @@ Created on Tue Nov 15 16:22:11 2016
 @author: maxwell
 """
 
+from atmosphere import AtmosphereBatch
+import numpy as np
+
+
 class RadModel(object):
     """
     Generic interface for Radiation model
     """
 
+    #True if radiation() accepts an AtmosphereBatch in one call
+    _packed = False
+    #False if the last result was an approximation (see LinearizedRadModel)
+    lastexact = True
+    #max. temperature change (K) for reusing the shortwave (None: never)
+    swtol = None
+    swreused = 0
+    _swref = None
+    #profiles the shortwave depends on, besides temperature
+    _swinputs = ('plev', 'qlay', 'o3lay')
+    #attributes that set the results of the model (see CachedRadModel)
+    _settings = ()
+
     def __init__(self,*args,**kwargs):
         raise NotImplementedError
 
     def radiation(self,atms,cparm,lwparm,swparm):
         raise NotImplementedError
 
+    def radiation_batch(self,atms,cparm,lwparm,swparm):
+        """
+        Calculates radiation for many columns.
+
+        atms is a list of Atmosphere objects or an AtmosphereBatch. Each parm
+        may be a single object shared by all columns or a list with one
+        object per column. Columns with identical parameters are computed
+        together: in one radiation() call on an AtmosphereBatch if the model
+        is _packed and the columns share a grid, otherwise one call per
+        column.
+
+        Returns a list of Flux objects for a list of columns, or one batched
+        Flux (variables of shape (ncol, nlev)) for an AtmosphereBatch.
+        """
+        if isinstance(atms, AtmosphereBatch):
+            ncol = atms.ncol
+        else:
+            ncol = len(atms)
+
+        flxs = [None]*ncol
+        for icols, cp, lp, sp in _groupcolumns(
+                ncol, cparm, lwparm, swparm):
+            for icol, flx in zip(
+                    icols, self._radiation_group(atms, icols, cp, lp, sp)):
+                flxs[icol] = flx
+
+        if isinstance(atms, AtmosphereBatch):
+            return Flux.fromcolumns(flxs)
+        return flxs
+
+    def _swreuse(self,atms,cparm,swparm):
+        """
+        Shortwave fluxes of the last call, if they may be reused for atms.
+
+        That is the case if swtol is set, the absorbers (q, o3, the gases in
+        cparm), the grid and swparm (albedo, coszen, fday, scon) are
+        unchanged since the fluxes were stored by _swstore, and no
+        temperature moved by more than swtol. Returns None otherwise.
+        """
+        ref = self._swref
+        if self.swtol is None or ref is None:
+            return None
+        if ref['parms'] != _parmkey(cparm, swparm):
+            return None
+        for name in self._swinputs:
+            if not np.array_equal(getattr(atms, name), ref[name]):
+                return None
+        if np.shape(atms.tlev) != np.shape(ref['tlev']):
+            return None
+        if np.max(np.abs(atms.tlev - ref['tlev'])) > self.swtol:
+            return None
+        self.swreused += 1
+        return ref['sw']
+
+    def _swstore(self,atms,cparm,swparm,sw):
+        """
+        Keep freshly computed shortwave fluxes sw for _swreuse.
+        """
+        if self.swtol is None:
+            return
+        for f in sw:
+            f.flags.writeable = False
+        self._swref = {name: np.copy(getattr(atms, name))
+                       for name in self._swinputs + ('tlev',)}
+        self._swref['parms'] = _parmkey(cparm, swparm)
+        self._swref['sw'] = sw
+
+    def _radiation_group(self,atms,icols,cparm,lwparm,swparm):
+        """
+        Fluxes for columns icols of atms, which share all parameters.
+        """
+        if not self._packed:
+            return [self.radiation(_column(atms,icol), cparm, lwparm, swparm)
+                    for icol in icols]
+
+        flxs = {}
+        for gcols in _gridgroups(atms, icols):
+            if len(gcols) == 1:
+                flxs[gcols[0]] = self.radiation(
+                    _column(atms,gcols[0]), cparm, lwparm, swparm)
+                continue
+
+            if isinstance(atms, AtmosphereBatch) and len(gcols) == atms.ncol:
+                batch = atms
+            else:
+                batch = AtmosphereBatch.fromcolumns(
+                    [_column(atms,icol) for icol in gcols])
+            flx = self.radiation(batch, cparm, lwparm, swparm)
+            for j, icol in enumerate(gcols):
+                flxs[icol] = flx.column(j)
+        return [flxs[icol] for icol in icols]
+
+
+def _column(atms, icol):
+    """Column icol of a list of Atmosphere objects or an AtmosphereBatch."""
+    if isinstance(atms, AtmosphereBatch):
+        return atms.column(icol)
+    return atms[icol]
+
+
+def _parmkey(*parms):
+    """Hashable snapshot of the values of parameter objects."""
+    return tuple(tuple(sorted(parm.items())) for parm in parms)
+
+
+def _gridgroups(atms, icols):
+    """
+    Split column indices icols into groups of columns on the same grid.
+    """
+    if isinstance(atms, AtmosphereBatch):
+        return [list(icols)]
+
+    groups = {}
+    order = []
+    for icol in icols:
+        key = (atms[icol].gridstagger, atms[icol].plev.tobytes())
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(icol)
+    return [groups[key] for key in order]
+
+
+def _groupcolumns(ncol, cparm, lwparm, swparm):
+    """
+    Group columns by their parameter values.
+
+    Returns a list of (icols, cparm, lwparm, swparm) with the column indices
+    of each distinct parameter set, in order of first appearance.
+    """
+    parms = []
+    for parm in (cparm, lwparm, swparm):
+        if isinstance(parm, (list, tuple)):
+            if len(parm) != ncol:
+                estr = "Expected {} parameter objects (one per column), got {}"
+                raise ValueError(estr.format(ncol, len(parm)))
+            parms.append(parm)
+        else:
+            parms.append([parm]*ncol)
+
+    groups = {}
+    order = []
+    for icol, colparms in enumerate(zip(*parms)):
+        key = _parmkey(*colparms)
+        if key not in groups:
+            groups[key] = ([],) + colparms
+            order.append(key)
+        groups[key][0].append(icol)
+    return [groups[key] for key in order]
+
 class Flux(object):
     """
     Flux container
@@ -35,6 +202,20 @@ class Flux(object):
         self._fusw = fusw
         self._fdsw = fdsw
 
+    @classmethod
+    def fromcolumns(cls, flxs):
+        """
+        Stack single-column Flux objects into one batched Flux.
+        """
+        return cls(*[np.stack([getattr(flx, name) for flx in flxs])
+                     for name in ('_fuir','_fdir','_fusw','_fdsw')])
+
+    def column(self, icol):
+        """
+        Return column icol of a batched Flux as a single-column Flux.
+        """
+        return self.__class__(self._fuir[icol], self._fdir[icol],
+                    self._fusw[icol], self._fdsw[icol])
 
     @property
     def fir(self):
@@ -46,15 +227,15 @@ class Flux(object):
 
     @property
     def ftoa(self):
-        return self.fsw[0]+self.olr
+        return self.fsw[...,0]+self.olr
 
     @property
     def olr(self):
-        return self.fir[0]
+        return self.fir[...,0]
 
     @property
     def fsfc(self):
-        return self.fsw[-1]+self.fir[-1]
+        return self.fsw[...,-1]+self.fir[...,-1]
 
     @property
     def f(self):
@@ -11,18 +11,89 @@ Created on Tue Nov 15 18:43:23 2016
 
 
 from radiation.radiation import RadModel,Flux
+from radiation.workers import SharedArrays, RadWorker, timedcall
 import radiation.pyrrtmg as rr
+from concurrent.futures import ThreadPoolExecutor
+import time
 import numpy as np
 
 
+#argument order of rr.lw.rad and rr.sw.rad
+_radargs = ('play','plev','tlay','tlev','tsfc','qlay','o3lay')
+
+
+def _rrtmgworker(conn, kind, cpdair, shared):
+    """
+    Serve LW or SW (kind) requests for RRTMGModel in a worker process.
+
+    Inputs are read from and fluxes written to the shared arrays; each
+    request carries the parameter dictionary and is answered with the time
+    spent in RRTMG.
+    """
+    module = getattr(rr, kind)
+    if cpdair is None:
+        module.init()
+    else:
+        module.init(cpdair)
+
+    args = [shared[name] for name in _radargs]
+    fu = shared[kind + 'fu']
+    fd = shared[kind + 'fd']
+    while True:
+        parms = conn.recv()
+        if parms is None:
+            break
+        try:
+            (fu[...], fd[...]), dt = timedcall(module.rad, *args, **parms)
+            conn.send(dt)
+        except Exception as err:
+            conn.send(err)
+    conn.close()
+
+
 class RRTMGModel(RadModel):
     """
     Class construct for pyrrtmg
     """
 
-    def __init__(self,cpdair=None,**kwargs):
+    _concurrentmodes = (None, 'thread', 'process')
+    _settings = ('_cpdair', 'swtol')
+
+    def __init__(self,cpdair=None,concurrent=None,swtol=None,packed=False,
+                 **kwargs):
+        """
+        With concurrent='thread' the SW calculation runs in a helper thread
+        while LW runs in the caller, which only overlaps if pyrrtmg releases
+        the GIL (f2py 'threadsafe'). With concurrent='process' LW and SW run
+        in a pair of persistent worker processes that exchange profiles and
+        fluxes with the model through shared memory.
+
+        The breakdown of the last call (lw, sw and wall time in s) is kept in
+        self.timings, and running sums in self.timetotals.
+
+        If swtol (K) is given, rr.sw.rad is skipped and the last shortwave
+        fluxes reused while only temperature changed, by no more than swtol
+        (see RadModel._swreuse); self.swreused counts those calls. This
+        mainly pays off in fixed-q runs (holdrh=False) with fixed ozone.
 
+        Set packed=True only if pyrrtmg was built with a column dimension;
+        then radiation_batch passes an AtmosphereBatch in one call. The stock
+        single-column build is called once per column.
+        """
         print('ititializing rrtmg object')
+        if concurrent not in self._concurrentmodes:
+            estr = "{} is not a valid concurrent mode. Use one of {}."
+            raise ValueError(estr.format(concurrent, self._concurrentmodes))
+        self.concurrent = concurrent
+        self.swtol = swtol
+        self._cpdair = cpdair
+        self._pool = None
+        self._workers = None
+        self._buf = None
+        self._bufshapes = None
+        self.timings = None
+        self.timetotals = {'lw': 0.0, 'sw': 0.0, 'wall': 0.0, 'calls': 0}
+
         if cpdair is None:
             print(
                 "WARNING: cpdair not provided to RRTMGModel. " ,
@@ -33,6 +104,9 @@ class RRTMGModel(RadModel):
         else:
             rr.lw.init(cpdair)
             rr.sw.init(cpdair)
+
+        self._packed = packed
+
     def radiation(self,atms,cparm,lwparm, swparm):
         """
         Calculates RRTMG radiation.
@@ -61,25 +135,137 @@ class RRTMGModel(RadModel):
             coszen
             scon
 
+        An AtmosphereBatch is passed as (ncol, n) arrays in one call, which
+        requires pyrrtmg built with a column dimension (see packed).
+
         Returns a Flux object with short and longwave fluxes
         """
-        fuir = np.empty(len(atms.plev))
-        fdir = np.empty(len(atms.plev))
-        fusw = np.empty(len(atms.plev))
-        fdsw = np.empty(len(atms.plev))
-
-        # flip indices, since rrtm expects pressure to decrease with index,
-        # while the Atmosphere class expects pressure to increase with index.
-        (fuir[::-1], fdir[::-1]) = rr.lw.rad(atms.play[::-1], atms.plev[::-1],
-                                 atms.tlay[::-1], atms.tlev[::-1],
-                                 atms.tsfc,
-                                 atms.qlay[::-1], atms.o3lay[::-1],
-                                 **cparm, **lwparm)
-        (fusw[::-1], fdsw[::-1]) = rr.sw.rad(atms.play[::-1], atms.plev[::-1],
-                                 atms.tlay[::-1], atms.tlev[::-1],
-                                 atms.tsfc,
-                                 atms.qlay[::-1], atms.o3lay[::-1],
-                                 **cparm, **swparm)
-
-        return Flux(fuir,fdir,fusw,fdsw)
+        st = time.perf_counter()
+        args = self._fillinputs(atms)
+        sw = self._swreuse(atms, cparm, swparm)
+        fresh = sw is None
+
+        if self.concurrent == 'process':
+            (lw, tlw), (sw, tsw) = self._radprocess(cparm, lwparm, swparm, sw)
+        elif not fresh:
+            lw, tlw = timedcall(rr.lw.rad, *args, **cparm, **lwparm)
+            tsw = 0.0
+        elif self.concurrent == 'thread':
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=1)
+            future = self._pool.submit(
+                timedcall, rr.sw.rad, *args, **cparm, **swparm)
+            lw, tlw = timedcall(rr.lw.rad, *args, **cparm, **lwparm)
+            sw, tsw = future.result()
+        else:
+            lw, tlw = timedcall(rr.lw.rad, *args, **cparm, **lwparm)
+            sw, tsw = timedcall(rr.sw.rad, *args, **cparm, **swparm)
+        if fresh:
+            self._swstore(atms, cparm, swparm, sw)
+
+        self._settimings(tlw, tsw, time.perf_counter()-st)
+        #the outputs are fresh (reused SW ones read-only), so bottom-up views
+        #of them are safe
+        return Flux(*[f[...,::-1] for f in lw + sw])
+
+    def _fillinputs(self, atms):
+        """
+        Copy the profiles top-down into the persistent input buffers.
+
+        rrtm expects pressure to decrease with index, while the Atmosphere
+        class expects pressure to increase with index. The buffers are
+        contiguous (Fortran order for batches) so f2py uses them without a
+        further copy; they are reallocated only when the profile shapes
+        change. Returns the buffers in rr.lw.rad/rr.sw.rad argument order.
+        """
+        layshape = np.shape(atms.tlay)
+        levshape = np.shape(atms.tlev)
+        shapes = (('play', layshape), ('plev', levshape),
+                  ('tlay', layshape), ('tlev', levshape),
+                  ('tsfc', np.shape(atms.tsfc)),
+                  ('qlay', layshape), ('o3lay', layshape))
+        if shapes != self._bufshapes:
+            self._allocate(shapes, levshape)
+
+        buf = self._buf
+        #pressure is shared by all columns of a batch
+        np.copyto(buf['play'], atms.play[::-1])
+        np.copyto(buf['plev'], atms.plev[::-1])
+        np.copyto(buf['tlay'], atms.tlay[...,::-1])
+        np.copyto(buf['tlev'], atms.tlev[...,::-1])
+        np.copyto(buf['tsfc'], atms.tsfc)
+        np.copyto(buf['qlay'], atms.qlay[...,::-1])
+        np.copyto(buf['o3lay'], atms.o3lay[...,::-1])
+        return [buf[name] for name in _radargs]
+
+    def _allocate(self, shapes, levshape):
+        """
+        (Re)allocate the input buffers for new profile shapes.
+
+        In process mode they are shared memory, together with the flux
+        outputs, and the workers are restarted, since shared memory can only
+        be handed to a process when it starts.
+        """
+        self.close()
+        if self.concurrent == 'process':
+            outputs = tuple((name, levshape)
+                            for name in ('lwfu','lwfd','swfu','swfd'))
+            self._buf = SharedArrays(shapes + outputs, order='F')
+            self._workers = {
+                kind: RadWorker(_rrtmgworker, kind, self._cpdair, self._buf)
+                for kind in ('lw','sw')
+                }
+        else:
+            self._buf = {name: np.empty(shape, order='F')
+                         for name, shape in shapes}
+        self._bufshapes = shapes
+
+    def _radprocess(self, cparm, lwparm, swparm, sw=None):
+        """
+        LW and SW in the two worker processes, on the filled shared buffers.
+
+        If reused shortwave fluxes sw are given, only LW is computed.
+        """
+        kinds = ('lw',) if sw is not None else ('lw','sw')
+        self._workers['lw'].send(dict(cparm, **lwparm))
+        if sw is None:
+            self._workers['sw'].send(dict(cparm, **swparm))
+        #collect every answer before raising, so that no reply is left in a
+        #pipe to be mistaken for the answer to the next call
+        times = {'sw': 0.0}
+        errors = []
+        for kind in kinds:
+            try:
+                times[kind] = self._workers[kind].recv()
+            except Exception as err:
+                errors.append(err)
+        if errors:
+            raise errors[0]
+        tlw, tsw = times['lw'], times['sw']
+
+        #the shared outputs are overwritten by the next call
+        buf = self._buf
+        if sw is None:
+            sw = (buf['swfu'].copy(), buf['swfd'].copy())
+        return (((buf['lwfu'].copy(), buf['lwfd'].copy()), tlw), (sw, tsw))
+
+    def _settimings(self, tlw, tsw, wall):
+        self.timings = {'lw': tlw, 'sw': tsw, 'wall': wall}
+        for key, value in self.timings.items():
+            self.timetotals[key] += value
+        self.timetotals['calls'] += 1
+
+    def close(self):
+        """
+        Stop helper threads or worker processes of the concurrent mode.
+        """
+        if self._workers is not None:
+            for worker in self._workers.values():
+                worker.close()
+            self._workers = None
+            self._buf = None
+            self._bufshapes = None
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
 
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent worker processes for radiation calculations.
+
+Workers are started once, initialize their radiation code once and then
+serve requests over a Pipe. Profile data is exchanged through shared memory
+(multiprocessing.RawArray) that parent and worker both map as numpy arrays,
+so only the small parameter dictionaries are pickled per call.
+"""
+
+__all__ = ['SharedArrays', 'RadWorker', 'timedcall', 'ready']
+
+
+import multiprocessing as mp
+from multiprocessing.connection import wait
+import time
+
+import numpy as np
+
+
+def timedcall(func, *args, **kwargs):
+    """Call func and return (result, elapsed wall time in s)."""
+    st = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter()-st
+
+
+def ready(workers, timeout=None):
+    """Workers (from the sequence workers) with an answer waiting."""
+    conns = wait([worker._conn for worker in workers], timeout)
+    return [worker for worker in workers if worker._conn in conns]
+
+
+class SharedArrays(object):
+    """
+    Named float arrays backed by one shared-memory block.
+
+    shapes is a sequence of (name, shape) pairs and order the memory layout
+    of each array ('C' or 'F'). The object can be passed to a worker process
+    when it is started; both sides then see the same data through the numpy
+    views in self.arrays.
+    """
+
+    def __init__(self, shapes, order='C'):
+        self.shapes = tuple((name, tuple(shape)) for name, shape in shapes)
+        self.order = order
+        size = sum(int(np.prod(shape)) for name, shape in self.shapes)
+        self._raw = mp.RawArray('d', max(size, 1))
+        self._map()
+
+    def _map(self):
+        buf = np.frombuffer(self._raw, dtype=float)
+        self.arrays = {}
+        start = 0
+        for name, shape in self.shapes:
+            size = int(np.prod(shape))
+            self.arrays[name] = buf[start:start+size].reshape(
+                shape, order=self.order)
+            start += size
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __getstate__(self):
+        return {'shapes': self.shapes, 'order': self.order, '_raw': self._raw}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+
+class RadWorker(object):
+    """
+    Handle on one persistent worker process.
+
+    target(conn, *args) runs in the worker and serves requests from conn
+    until it receives None. Each request must be answered with exactly one
+    message: either a result or an Exception instance, which is re-raised
+    in the parent.
+    """
+
+    def __init__(self, target, *args):
+        self._conn, child = mp.Pipe()
+        self._proc = mp.Process(target=target, args=(child,) + args)
+        self._proc.daemon = True
+        self._proc.start()
+        child.close()
+
+    def send(self, msg):
+        """Start a request without waiting for the answer."""
+        self._conn.send(msg)
+
+    def recv(self):
+        """Wait for the answer to the last request."""
+        result = self._conn.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        """Stop the worker process."""
+        try:
+            self._conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self._proc.join(timeout=5)
+        if self._proc.is_alive():
+            self._proc.terminate()
+        self._conn.close()
@@ -17,9 +17,15 @@ class SolverFactory(object):
     from solver.rad import RadSolver
     from solver.radeq import RadEqSolver
     from solver.rce import RCESolver
+    from solver.radeqadapt import AdaptiveRadEqSolver
+    from solver.radeqnewton import NewtonRadEqSolver
+    from solver.radeqimplicit import ImplicitRadEqSolver
 
     #add dictionary listings for new models. String keys should be lower case
-    _classnames = {'rad':RadSolver, 'radeq':RadEqSolver,'rce':RCESolver}
+    _classnames = {'rad':RadSolver, 'radeq':RadEqSolver,'rce':RCESolver,
+                   'radeq-adaptive':AdaptiveRadEqSolver,
+                   'radeq-newton':NewtonRadEqSolver,
+                   'radeq-implicit':ImplicitRadEqSolver}
 
     @classmethod
     def create(cls,kind=None, **kwargs):
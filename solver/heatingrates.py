@@ -36,10 +36,10 @@ class HR(object):
         zs, hrirs, hrsws = readprof_hr(fname)
 
         if atms is not None:
-            hrir = np.empty(len(atms))
-            hrsw = np.empty(len(atms))
-            hrir[::-1] = Atmosphere.interp(zs[::-1], hrirs[::-1],atms.z[::-1])
-            hrsw[::-1] = Atmosphere.interp(zs[::-1], hrsws[::-1],atms.z[::-1])
+            #z decreases with index, so flip to interpolate in ascending order
+            (hrir, hrsw) = Atmosphere.interp(
+                zs[::-1], np.vstack((hrirs, hrsws))[:,::-1], atms.z[::-1]
+                )[:,::-1]
         else:
             hrir = hrirs
             hrsw = hrsws
@@ -67,8 +67,8 @@ def _hr12(atms,flx):
     """
     f = ((c.grav*c.secperdy)/(c.mb2pa*c.cpdair))
     dpinv = 1.0/(atms.plev[:-1] - atms.plev[1:])
-    hrir = f*((flx.fir[:-1]-flx.fir[1:])*dpinv)
-    hrsw = f*((flx.fsw[:-1]-flx.fsw[1:])*dpinv)
+    hrir = f*((flx.fir[...,:-1]-flx.fir[...,1:])*dpinv)
+    hrsw = f*((flx.fsw[...,:-1]-flx.fsw[...,1:])*dpinv)
 
 
     hrir = np.sign(hrir)*np.minimum(HR._maxHR, np.abs(hrir))
@@ -84,11 +84,11 @@ def _hr23(atms,flx):
 
     f = ((c.grav*c.secperdy)/(c.mb2pa*c.cpdair))
 
-    hrir = np.empty(len(atms.plev))
-    hrsw = np.empty(len(atms.plev))
-
     fir = flx.fir.copy()
     fsw = flx.fsw.copy()
+
+    hrir = np.empty(np.shape(fir))
+    hrsw = np.empty(np.shape(fsw))
 #    fir[[-1]] = 0.0
 #    fsw[[-1]] = 0.0
 
@@ -99,10 +99,10 @@ def _hr23(atms,flx):
     c1 = dprat*dpinv
     c2 = (1.0/dprat)*dpinv
 
-    hrir[1:-1] = f*( c1*(fir[1:-1]-fir[:-2])
-                    +c2*(fir[2:]-fir[1:-1]) )
-    hrsw[1:-1] = f*( c1*(fsw[1:-1]-fsw[:-2])
-                    +c2*(fsw[2:]-fsw[1:-1]) )
+    hrir[...,1:-1] = f*( c1*(fir[...,1:-1]-fir[...,:-2])
+                    +c2*(fir[...,2:]-fir[...,1:-1]) )
+    hrsw[...,1:-1] = f*( c1*(fsw[...,1:-1]-fsw[...,:-2])
+                    +c2*(fsw[...,2:]-fsw[...,1:-1]) )
 
     #forward diff on edges
     dprat = np.array(
@@ -116,14 +116,16 @@ def _hr23(atms,flx):
     c2 = (1.0/dprat)*dpinv
 
 
-    hrir[0] = f*(c1[0]*(fir[2]-fir[0]) +c2[0]*(fir[0]-fir[1]))
-    hrsw[0] = f*(c1[0]*(fsw[2]-fsw[0]) +c2[0]*(fsw[0]-fsw[1]))
+    hrir[...,0] = f*(
+        c1[0]*(fir[...,2]-fir[...,0]) +c2[0]*(fir[...,0]-fir[...,1]) )
+    hrsw[...,0] = f*(
+        c1[0]*(fsw[...,2]-fsw[...,0]) +c2[0]*(fsw[...,0]-fsw[...,1]) )
 
 
-    hrir[-1] = f*(
-        c1[1]*(fir[-3]-fir[-1]) +c2[1]*(fir[-1]-fir[-2]) )
-    hrsw[-1] = f*(
-        c1[1]*(fsw[-3]-fsw[-1]) +c2[1]*(fsw[-1]-fsw[-2]) )
+    hrir[...,-1] = f*(
+        c1[1]*(fir[...,-3]-fir[...,-1]) +c2[1]*(fir[...,-1]-fir[...,-2]) )
+    hrsw[...,-1] = f*(
+        c1[1]*(fsw[...,-3]-fsw[...,-1]) +c2[1]*(fsw[...,-1]-fsw[...,-2]) )
 
 #    #HR is 0 at bottom, since we use a different algorithm for tsfc
 #    hrir[-1] = 0
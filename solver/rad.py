@@ -10,6 +10,7 @@ Created on Fri Nov 18 09:55:53 2016
 
 from .heatingrates import heatingrates
 from .solver import Solver
+from radiation.radiation import Flux
 
 
 class RadSolver(Solver):
@@ -28,3 +29,17 @@ class RadSolver(Solver):
         print('{}: running solverloop'.format(self.__class__.__name__))
         return self._do1timestep(atms,cparm,lwparm,swparm)
 
+    def solve_batch(self, atms, cparm, lwparm, swparm):
+        """
+        Offline radiation for many columns through RadModel.radiation_batch.
+
+        atms is a list of Atmosphere objects or an AtmosphereBatch; each parm
+        may be shared or given as a list with one object per column. Returns
+        lists of Atmosphere, Flux and HR objects, or single batched objects
+        for an AtmosphereBatch.
+        """
+        print('{}: running batched solve'.format(self.__class__.__name__))
+        flx = self._radmodel.radiation_batch(atms, cparm, lwparm, swparm)
+        if isinstance(flx, Flux):
+            return atms, flx, heatingrates(atms, flx)
+        return atms, flx, [heatingrates(x, f) for x, f in zip(atms, flx)]
@@ -9,6 +9,10 @@ Created on Fri Nov 18 17:41:20 2016
 """
 
 from .rad import RadSolver
+from .heatingrates import heatingrates
+from radiation.jacobian import perturbationjacobian
+import numpy as np
+import time
 
 
 class RadEqSolver(RadSolver):
@@ -20,11 +24,63 @@ class RadEqSolver(RadSolver):
     _timestepdefault = 0.25
     _tsfc_ffac = 0.1
     _maxsteps = 3000
+    _radintmax = 50
+    _dtmin_krel = 1.0e-3
     holdtsfc = False
     auxhr = None
+    radint = 1
+    radthresh = None
+    localdt = False
+    _localcfl = 0.5
+    _localdtmax = 30.0
+    #half width of the banded heating rate Jacobian, and its refresh interval
+    #in radiation calls
+    _localband = 2
+    _localjacint = 20
+    anderson = 0
+    #Anderson history reset: growth of the step change, largest correction (K)
+    _andersongrow = 1.0
+    _andersonmaxdx = 20.0
 
     def __init__(self, timestep=None, tol=None, maxsteps=None,
-                 holdtsfc=None, auxhr=None, **kwargs):
+                 holdtsfc=None, auxhr=None, radint=None, radthresh=None,
+                 localdt=None, localdtmax=None, anderson=None, **kwargs):
+        """
+        Radiation is called every radint steps (default every step). If
+        radthresh (K) is given, it is also called as soon as any temperature
+        (or tsfc) has changed by more than radthresh since the last call; in
+        that case radint defaults to _radintmax.
+
+        In between, the heating rates of the last call are reused, corrected
+        for the temperature change since that call with a per-level
+        relaxation rate estimated from the last two calls (a secant estimate
+        of -dhr/dT, clipped to [0, 1/timestep]). Without this correction the
+        persisted heating overshoots wherever the radiative relaxation time
+        is shorter than the radiation interval. The surface temperature is
+        only adjusted on steps with fresh fluxes, and equilibrium is only
+        declared on those steps.
+
+        With localdt=True every level takes its own pseudo-time step,
+        _localcfl times its radiative relaxation time, between timestep and
+        localdtmax (days, default _localdtmax). The relaxation rate is the
+        sensitivity -dhr/dT of the level's own heating rate, the diagonal of
+        a banded Jacobian (see perturbationjacobian) that is rebuilt every
+        _localjacint radiation calls, or the secant estimate above if that
+        is larger. Levels at the HR._maxHR clip, where the sensitivity
+        vanishes, keep timestep. This does not move the equilibrium, but the
+        slow upper levels no longer set the number of steps. The equilibrium
+        test then uses the temperature change scaled to timestep.
+
+        With anderson=m > 0 the states (t and, unless holdtsfc, tsfc) are
+        Anderson mixed: the change made by each step is taken as the
+        residual of the fixed-point map, and the next state is extrapolated
+        from the last m+1 states and their changes. The history is dropped
+        when the change grows by more than _andersongrow from one step to
+        the next, when the convective top (atms.iconv, for RCESolver) moves,
+        or when the extrapolation would move a temperature by more than
+        _andersonmaxdx; that step is then a plain time step. Equilibrium is
+        still tested on the plain time step.
+        """
         if timestep is None:
             estr="WARNING: timestep not assigned. Using default value of {} d"
             print(estr.format(self._timestep))
@@ -47,32 +103,207 @@ class RadEqSolver(RadSolver):
         if auxhr is not None:
             print("Using aux. HR profile")
             self.auxhr = auxhr
+        if radthresh is not None:
+            self.radthresh = radthresh
+            self.radint = self._radintmax
+        if radint is not None:
+            self.radint = radint
+        if self.radint > 1:
+            print("Calling radiation every {} steps (threshold {} K)".format(
+                  self.radint, self.radthresh))
+        if localdt is not None:
+            self.localdt = localdt
+        if localdtmax is not None:
+            self._localdtmax = localdtmax
+        if self.localdt:
+            print("Using local time steps of up to {} d".format(
+                  self._localdtmax))
+        if anderson is not None:
+            self.anderson = anderson
+        if self.anderson:
+            print("Using Anderson mixing of the last {} steps".format(
+                  self.anderson))
 
         self._equilibrated = False
+        self._lastrad = None
+        self._localsens = None
+        self._fresh = True
+        self.radcalls = 0
+        self.sensitivitycalls = 0
+        self._andersonhist = None
+        self.andersonresets = 0
 
         super().__init__( **kwargs)
 
     def _do1timestep(self,atms,cparm,lwparm,swparm):
-        atms, flx, hr  = super()._do1timestep(atms,cparm,lwparm,swparm)
+        self._fresh = self._needradiation(atms)
+        if self._fresh:
+            atms, flx, hr  = super()._do1timestep(atms,cparm,lwparm,swparm)
+            self._storeradiation(atms, flx, hr)
+            if self.localdt:
+                self._lastrad['dt'] = self._localtimestep(
+                    atms, cparm, lwparm, swparm)
+            heating = hr.hr
+            #approximate fluxes (e.g. linearized) do not count as fresh
+            self._fresh = self._radmodel.lastexact
+        else:
+            flx = self._lastrad['flx']
+            hr = self._lastrad['hr']
+            heating = hr.hr - self._lastrad['krel']*(
+                atms.t - self._lastrad['t'])
+        self._lastrad['nstep'] += 1
+        dt = self._lastrad['dt']
 
-        if self.auxhr is not None:
-            atms.t += (self.auxhr.hr + hr.hr)*self._timestep
+        #all changes to the state in this step share one grid update
+        with atms.batch():
+            if self.auxhr is not None:
+                atms.t += (self.auxhr.hr + heating)*dt
+            else:
+                atms.t += heating*dt
+
+            if not self.holdtsfc and self._fresh:
+                tsfc_old = atms.tsfc.copy()
+                atms.tsfc *= (1.0 - self._tsfc_ffac*flx.ftoa/flx.olr)
+                dtsfc = atms.tsfc - tsfc_old
+                atms.tsfc += dtsfc
+
+                #nudge all temperatures down if surface temp decreases
+                if dtsfc < 0:
+                    atms.t[atms.p >= atms.pcold] += dtsfc
+
+        return atms,flx,hr
+
+    def _storeradiation(self, atms, flx, hr):
+        """
+        Keep a fresh radiation result for the following steps.
+
+        The state and the relaxation rates are only kept if they are used,
+        i.e. if radiation is not called on every step or with localdt.
+        """
+        self.radcalls += 1
+        if self.radint == 1 and self.radthresh is None and not self.localdt:
+            self._lastrad = {'flx': flx, 'hr': hr, 'nstep': 0,
+                             'dt': self._timestep}
+            return
+
+        last = self._lastrad
+        t = atms.t.copy()
+        if last is None or 'krel' not in last:
+            krel = np.zeros_like(t)
         else:
-            atms.t += hr.hr*self._timestep
+            krel = last['krel']
+            dt = t - last['t']
+            idx = np.abs(dt) > self._dtmin_krel
+            krel = krel.copy()
+            krel[idx] = np.clip(-(hr.hr[idx] - last['hr'].hr[idx])/dt[idx],
+                                0.0, 1.0/self._timestep)
+
+        self._lastrad = {'flx': flx, 'hr': hr, 'nstep': 0, 't': t,
+                         'tsfc': atms.tsfc.copy(), 'krel': krel,
+                         'dt': self._timestep}
 
+    def _localtimestep(self, atms, cparm, lwparm, swparm):
+        """
+        Per-level time steps (days) from the radiative relaxation rates.
+        """
+        sens = self._localsens
+        if sens is None or sens['ncall'] >= self._localjacint:
+            hr0, jac = perturbationjacobian(
+                self._radmodel, atms, cparm, lwparm, swparm,
+                lambda col, flx: heatingrates(col, flx).hr,
+                band=self._localband)
+            sens = {'krel': -np.diagonal(jac[:,:-1]), 'ncall': 0}
+            self._localsens = sens
+            self.sensitivitycalls += 1
+        sens['ncall'] += 1
 
+        krel = np.maximum(sens['krel'], self._lastrad['krel'])
+        dt = np.full(len(krel), self._timestep)
+        idx = krel > 0.0
+        dt[idx] = np.clip(self._localcfl/krel[idx], self._timestep,
+                          self._localdtmax)
+        return dt
 
+    def _residual(self, atms, flx):
+        """
+        Heating rates and, unless holdtsfc, the tsfc tendency (K/day) of
+        the time steps, which vanish in equilibrium.
+
+        Like the time steps, the residual cannot push a temperature beyond
+        the limits of the Atmosphere; it is zero there.
+        """
+        f = heatingrates(atms, flx).hr
+        if self.auxhr is not None:
+            f = f + self.auxhr.hr
+        x = atms.t
         if not self.holdtsfc:
-            tsfc_old = atms.tsfc.copy()
-            atms.tsfc *= (1.0 - self._tsfc_ffac*flx.ftoa/flx.olr)
-            dtsfc = atms.tsfc - tsfc_old
-            atms.tsfc += dtsfc
+            rate = 2.0*self._tsfc_ffac/self._timestep
+            f = np.append(f, -rate*atms.tsfc*flx.ftoa/flx.olr)
+            x = np.append(x, atms.tsfc)
+        held = (((x >= atms._tmax) & (f > 0.0))
+                | ((x <= atms._tmin) & (f < 0.0)))
+        f[held] = 0.0
+        return f
 
-            #nudge all temperatures down if surface temp decreases
-            if dtsfc < 0:
-                atms.t[atms.p >= atms.pcold] += dtsfc
+    def _state(self, atms):
+        """Temperatures and, unless holdtsfc, tsfc as one vector."""
+        if self.holdtsfc:
+            return atms.t.copy()
+        return np.append(atms.t, atms.tsfc)
 
-        return atms,flx,hr
+    def _setstate(self, atms, x):
+        n = len(atms.t)
+        with atms.batch():
+            atms.t = x[:n]
+            if not self.holdtsfc:
+                atms.tsfc = x[n]
+
+    def _andersonmix(self, atms, x, g):
+        """
+        Anderson extrapolation after a time step from state x by change g.
+
+        Returns the next state, or None to keep the plain step.
+        """
+        hist = self._andersonhist
+        #the convective top, if there is one (RCESolver); the iconv property
+        #would fall back to the cold point, which moves without consequence
+        iconv = atms.__dict__.get('_iconv_top')
+        if hist['g'] and (
+                np.linalg.norm(g) > self._andersongrow*np.linalg.norm(
+                    hist['g'][-1])
+                or not np.array_equal(iconv, hist['iconv'])):
+            hist['x'], hist['g'] = [], []
+            self.andersonresets += 1
+        hist['iconv'] = iconv
+        hist['x'].append(x)
+        hist['g'].append(g)
+        if len(hist['x']) > self.anderson+1:
+            del hist['x'][0], hist['g'][0]
+        if len(hist['x']) < 2:
+            return None
+
+        dx = np.diff(hist['x'], axis=0).T
+        dg = np.diff(hist['g'], axis=0).T
+        gamma = np.linalg.lstsq(dg, g, rcond=None)[0]
+        corr = np.dot(dx + dg, gamma)
+        if np.max(np.abs(corr)) > self._andersonmaxdx:
+            hist['x'], hist['g'] = [], []
+            self.andersonresets += 1
+            return None
+        return x + g - corr
+
+    def _needradiation(self, atms):
+        """
+        True if the fluxes of the last radiation call are due for a refresh.
+        """
+        last = self._lastrad
+        if last is None or last['nstep'] >= self.radint:
+            return True
+        if self.radthresh is not None:
+            dt = max(np.max(np.abs(atms.t - last['t'])),
+                     np.max(np.abs(atms.tsfc - last['tsfc'])))
+            return dt > self.radthresh
+        return False
 
     def _solverloop(self,atms,cparm,lwparm,swparm):
         """
@@ -84,19 +315,41 @@ class RadEqSolver(RadSolver):
                  )
         else:
             print('{}: running solverloop'.format(self.__class__.__name__))
+        st = time.perf_counter()
+        self._lastrad = None
+        self._localsens = None
+        self._andersonhist = {'x': [], 'g': [], 'iconv': None}
+        self.radcalls = 0
+        self.sensitivitycalls = 0
+        self.andersonresets = 0
 
         for i in range(self._maxsteps):
             t_old = atms.t.copy()
+            if self.anderson:
+                x_old = self._state(atms)
             atms, flx,hr = self._do1timestep(atms,cparm,lwparm,swparm)
 
             idx = atms.p >= self._pmax_ref
-            if all(abs(atms.t[idx]-t_old[idx]) <= self._tol):
+            change = abs(atms.t-t_old)*(self._timestep/self._lastrad['dt'])
+            if self._fresh and all(change[idx] <= self._tol):
                 self._equilibrated = True
                 self._count = i
                 print("Equilibrium reached ({:d} iterations)".format(i+1))
                 break;
+
+            if self.anderson:
+                x = self._andersonmix(atms, x_old, self._state(atms)-x_old)
+                if x is not None:
+                    self._setstate(atms, x)
         else:
             print("Max number of iterations reached ({:d})".format(i+1))
+        if self.localdt:
+            print("Sensitivity updates: {:d}".format(self.sensitivitycalls))
+        if self.anderson:
+            print("Anderson history resets: {:d}".format(self.andersonresets))
+        self.walltime = time.perf_counter()-st
+        print("{}: {:d} iterations, {:d} radiation calls, {:.2f} s".format(
+              self.__class__.__name__, i+1, self.radcalls, self.walltime))
 
 
         return atms, flx, hr
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Radiative equilibrium Solver with adaptive pseudo-time steps.
+"""
+
+from .radeq import RadEqSolver
+from .heatingrates import HR
+import numpy as np
+import time
+
+
+class AdaptiveRadEqSolver(RadEqSolver):
+    """
+    Radiative Equilibrium, with a time step that adapts to the residual.
+    """
+
+    _dtmax = 20.0
+    _dtgrow = 1.5
+    _dtshrink = 0.5
+    #a step is undone if it raised the residual by more than this factor
+    _reject = 2.0
+    #share of the levels whose heating changes sign that counts as oscillation
+    _oscfrac = 0.1
+    #upper limit of the tsfc relaxation factor (its value at a 1 d step)
+    _tsfc_ffacmax = 0.2
+
+    def __init__(self, dtmin=None, dtmax=None, **kwargs):
+        """
+        The time step starts at timestep and then follows the residual, the
+        rms heating rate (K/day) below _pmax_ref, within [dtmin, dtmax]
+        (days; dtmin defaults to timestep/8). While the residual shrinks the
+        step grows by _dtgrow; when it grows the step is scaled by the ratio
+        of the last two residuals (at most down to _dtshrink). The step is
+        cut by _dtshrink when the heating changes sign on more than _oscfrac
+        of the levels that are still moving, it is held at or below
+        timestep while a net heating rate is at the HR._maxHR clip, and a
+        step after which the residual grew by more than _reject is undone.
+
+        Equilibrium is declared when the temperature change per step,
+        scaled to the nominal timestep, is below tol, which is the same
+        criterion as for RadEqSolver.
+        """
+        super().__init__(**kwargs)
+        self._dtnominal = self._timestep
+        self._dtmin = self._timestep/8.0
+        if dtmin is not None:
+            self._dtmin = dtmin
+        if dtmax is not None:
+            self._dtmax = dtmax
+        self.report = None
+
+    def _setdt(self, dt):
+        self._timestep = dt
+        self._tsfc_ffac = min(dt*0.2, self._tsfc_ffacmax)
+
+    def _solverloop(self,atms,cparm,lwparm,swparm):
+        """
+        Adaptive time stepping until equilibrium.
+        """
+        print('{}: running adaptive solverloop'.format(
+              self.__class__.__name__))
+        st = time.perf_counter()
+        self._lastrad = None
+        self.radcalls = 0
+
+        dt = self._dtnominal
+        dts = []
+        prev = None
+        nreject = 0
+        pseudotime = 0.0
+        idx = atms.p >= self._pmax_ref
+        for i in range(self._maxsteps):
+            tstart = atms.t.copy()
+            tsfcstart = np.copy(atms.tsfc)
+            self._setdt(dt)
+            atms, flx, hr = self._do1timestep(atms,cparm,lwparm,swparm)
+
+            heating = hr.hr if self.auxhr is None else hr.hr + self.auxhr.hr
+            res = np.sqrt(np.mean(heating[idx]**2))
+
+            #the last step made things worse: undo it and retry smaller
+            if (prev is not None and res > self._reject*prev['res']
+                    and prev['dt'] > self._dtmin):
+                with atms.batch():
+                    atms.t = prev['t']
+                    atms.tsfc = prev['tsfc']
+                pseudotime -= prev['dt']
+                dt = max(prev['dt']*self._dtshrink, self._dtmin)
+                self._lastrad = None
+                prev = None
+                nreject += 1
+                continue
+
+            dts.append(dt)
+            pseudotime += dt
+            dtscale = self._dtnominal/dt
+            if self._fresh and all(
+                    abs(atms.t[idx]-tstart[idx])*dtscale <= self._tol):
+                self._equilibrated = True
+                self._count = i
+                print("Equilibrium reached ({:d} iterations)".format(i+1))
+                break
+
+            #levels that still move by more than tol per nominal step
+            active = idx & (np.abs(heating)*self._dtnominal > self._tol)
+            saturated = np.any(np.abs(heating[idx]) >= HR._maxHR)
+            oscillating = (prev is not None and np.sum(
+                heating[active]*prev['heating'][active] < 0)
+                > self._oscfrac*max(np.sum(active), 1))
+            if oscillating:
+                dtnew = dt*self._dtshrink
+            elif prev is None:
+                dtnew = dt
+            elif res <= prev['res']:
+                dtnew = dt*self._dtgrow
+            else:
+                dtnew = dt*max(prev['res']/res, self._dtshrink)
+            #clipped rates are only meaningful at the nominal step
+            if saturated:
+                dtnew = min(dtnew, max(dt*self._dtshrink, self._dtnominal))
+            prev = {'t': tstart, 'tsfc': tsfcstart, 'res': res, 'dt': dt,
+                    'heating': heating}
+            dt = min(max(dtnew, self._dtmin), self._dtmax)
+        else:
+            print("Max number of iterations reached ({:d})".format(i+1))
+
+        self._setdt(self._dtnominal)
+        self.report = {'iterations': i+1, 'rejected': nreject,
+                       'radcalls': self.radcalls, 'pseudotime': pseudotime,
+                       #all steps may have been rejected
+                       'dtmin': min(dts, default=dt),
+                       'dtmax': max(dts, default=dt),
+                       'walltime': time.perf_counter()-st}
+        rstr = ("{cls}: {iterations:d} iterations ({rejected:d} rejected), "
+                "{radcalls:d} radiation calls, {pseudotime:.1f} d, "
+                "dt {dtmin:.3g}-{dtmax:.3g} d, {walltime:.2f} s")
+        print(rstr.format(cls=self.__class__.__name__, **self.report))
+
+        return atms, flx, hr
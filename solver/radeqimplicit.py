@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Radiative equilibrium Solver with linearized implicit time steps.
+"""
+
+from .radeq import RadEqSolver
+from .heatingrates import heatingrates
+from radiation.jacobian import bandedjacobian, jacobiancolumns
+import numpy as np
+import time
+
+
+class ImplicitRadEqSolver(RadEqSolver):
+    """
+    Radiative Equilibrium, with linearized backward Euler steps.
+    """
+
+    _implicitdt = 20.0
+    #banded Jacobian (see bandedjacobian) and its refresh interval in
+    #accepted steps
+    _implicitband = 2
+    _implicitsmooth = 8
+    _jacint = 5
+    #largest temperature change (K) of a step
+    _maxdx = 10.0
+    #step size control on the residual norm
+    _dtgrow = 1.5
+    _dtshrink = 0.5
+
+    def __init__(self, implicitdt=None, jacint=None, **kwargs):
+        """
+        Each step linearizes the residual F (the heating rates and the tsfc
+        tendency, see RadEqSolver._residual) about the current state with a
+        banded finite-difference Jacobian J (bandedjacobian with band
+        _implicitband and _implicitsmooth smooth modes, all perturbed
+        columns in one radiation_batch call) and takes the backward Euler
+        step
+
+            (I/dt - J) dx = F
+
+        solved in banded form (see BandedJacobian.implicitsolve). Where F
+        grows with the temperature (dF/dT > 0, no restoring sensitivity), dt
+        is at most 1/(2 dF/dT), but not below timestep, and levels held at
+        the temperature limits of the Atmosphere (where F is zero) stay
+        put; otherwise the coupling would pull them off the limit every
+        step. Steps larger than _maxdx are scaled down, which keeps the
+        linearization valid far from equilibrium.
+
+        dt starts at timestep and grows by _dtgrow after each accepted step,
+        up to implicitdt days (default _implicitdt), but not right after a
+        rejection. A step after which the norm of F (at or below _pmax_ref)
+        grew is rejected: the state goes back, dt is cut by _dtshrink (not
+        below timestep) and the step is retried with the same Jacobian, so
+        a rejection costs one radiation call. Only when a retry from an
+        older Jacobian is rejected too is the Jacobian rebuilt. It is
+        otherwise rebuilt every jacint accepted steps (default _jacint).
+        Steps of timestep are always accepted.
+
+        Equilibrium is declared as for RadEqSolver, when one step of
+        timestep would change no temperature at or below _pmax_ref, nor
+        tsfc, by more than tol.
+        """
+        super().__init__(**kwargs)
+        if implicitdt is not None:
+            self._implicitdt = implicitdt
+        if jacint is not None:
+            self._jacint = jacint
+        self.report = None
+
+    def _jacobian(self, atms, cparm, lwparm, swparm):
+        return bandedjacobian(self._radmodel, atms, cparm, lwparm, swparm,
+                              self._residual, band=self._implicitband,
+                              nsmooth=self._implicitsmooth)
+
+    def _solverloop(self,atms,cparm,lwparm,swparm):
+        """
+        Implicit time steps until equilibrium.
+        """
+        print('{}: running implicit solverloop ({} d steps)'.format(
+              self.__class__.__name__, self._implicitdt))
+        st = time.perf_counter()
+        self.radcalls = 0
+        self._equilibrated = False
+        jaccalls = 1
+        nreject = 0
+
+        idx = atms.p >= self._pmax_ref
+        if not self.holdtsfc:
+            idx = np.append(idx, True)
+        step = self._timestep
+        x = self._state(atms)
+        f, jac = self._jacobian(atms, cparm, lwparm, swparm)
+        fnorm = np.linalg.norm(f[idx])
+        age = 0
+        rejected = False
+        for i in range(self._maxsteps):
+            if np.max(np.abs(f[idx]))*self._timestep <= self._tol:
+                self._equilibrated = True
+                self._count = i
+                print("Equilibrium reached ({:d} iterations)".format(i+1))
+                break
+
+            dt = np.full(len(f), float(step))
+            diag = np.append(jac.diagonal(), jac.tsfc[-1])[:len(f)]
+            pos = diag > 0.0
+            dt[pos] = np.clip(0.5/diag[pos], self._timestep, step)
+            dt[(f == 0.0) & ((x >= atms._tmax) | (x <= atms._tmin))] = 0.0
+            dx = jac.implicitsolve(f, dt)
+            dxmax = np.max(np.abs(dx))
+            if dxmax > self._maxdx:
+                dx *= self._maxdx/dxmax
+            self._setstate(atms, x + dx)
+            fnew = self._residual(atms, self._radmodel.radiation(
+                atms, cparm, lwparm, swparm))
+            self.radcalls += 1
+            fnewnorm = np.linalg.norm(fnew[idx])
+
+            if fnewnorm > fnorm and step > self._timestep:
+                #the step made things worse: undo it and retry smaller
+                self._setstate(atms, x)
+                step = max(step*self._dtshrink, self._timestep)
+                nreject += 1
+                if rejected and age > 0:
+                    f, jac = self._jacobian(atms, cparm, lwparm, swparm)
+                    jaccalls += 1
+                    age = 0
+                rejected = True
+                continue
+
+            if not rejected:
+                step = min(step*self._dtgrow, self._implicitdt)
+            rejected = False
+            x, f, fnorm = self._state(atms), fnew, fnewnorm
+            age += 1
+            if age >= self._jacint:
+                f, jac = self._jacobian(atms, cparm, lwparm, swparm)
+                jaccalls += 1
+                age = 0
+        else:
+            print("Max number of iterations reached ({:d})".format(i+1))
+
+        flx = self._radmodel.radiation(atms, cparm, lwparm, swparm)
+        hr = heatingrates(atms, flx)
+        self.radcalls += 1
+
+        self.report = {'iterations': i+1, 'radcalls': self.radcalls,
+                       'jacobians': jaccalls, 'rejected': nreject,
+                       'columns': self.radcalls + jaccalls*jacobiancolumns(
+                           len(atms.t), self._implicitband,
+                           self._implicitsmooth),
+                       'walltime': time.perf_counter()-st}
+        rstr = ("{cls}: {iterations:d} iterations ({rejected:d} rejected), "
+                "{radcalls:d} radiation calls and {jacobians:d} Jacobian "
+                "batches ({columns:d} columns in all), {walltime:.2f} s")
+        print(rstr.format(cls=self.__class__.__name__, **self.report))
+
+        return atms, flx, hr
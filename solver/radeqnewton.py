@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Radiative equilibrium Solver using Jacobian-free Newton-Krylov iterations.
+"""
+
+from .radeq import RadEqSolver
+from .heatingrates import heatingrates
+from radiation.jacobian import bandedjacobian, jacobiancolumns
+import numpy as np
+import time
+
+
+def _gmres(matvec, b, psolve, tol, maxiter):
+    """
+    Solve matvec(x) = b by right-preconditioned GMRES, starting from x = 0.
+
+    psolve(r) applies the inverse of the preconditioner. The iteration stops
+    when the residual norm is below tol*|b|, or after maxiter products.
+    Returns x and the number of matvec calls.
+    """
+    beta = np.linalg.norm(b)
+    if beta == 0.0:
+        return np.zeros(len(b)), 0
+    basis = [b/beta]
+    precond = []
+    hess = np.zeros((maxiter+1, maxiter))
+    for j in range(maxiter):
+        precond.append(psolve(basis[j]))
+        w = matvec(precond[j])
+        #modified Gram-Schmidt
+        for i in range(j+1):
+            hess[i,j] = np.dot(w, basis[i])
+            w = w - hess[i,j]*basis[i]
+        hess[j+1,j] = np.linalg.norm(w)
+
+        rhs = np.zeros(j+2)
+        rhs[0] = beta
+        y = np.linalg.lstsq(hess[:j+2,:j+1], rhs, rcond=None)[0]
+        res = np.linalg.norm(np.dot(hess[:j+2,:j+1], y) - rhs)
+        if res <= tol*beta or hess[j+1,j] <= 1.0e-14*beta:
+            break
+        basis.append(w/hess[j+1,j])
+    return np.dot(np.transpose(precond), y), j+1
+
+
+class NewtonRadEqSolver(RadEqSolver):
+    """
+    Radiative Equilibrium, as the root of the heating rates.
+    """
+
+    _maxnewton = 200
+    #GMRES: relative tolerance (inexact Newton forcing term), max iterations
+    _gmrestol = 0.1
+    _gmresiter = 10
+    #perturbation (K, max norm) of the Jacobian-vector products
+    _jvdelta = 1.0e-2
+    #largest temperature change (K) of a Newton step, and of a pseudo-time
+    #step at the current residual
+    _maxdx = 20.0
+    #banded Jacobian of the preconditioner, see bandedjacobian
+    _precband = 2
+    _precsmooth = 8
+    #initial and largest pseudo-time step (days) of the continuation
+    _dtau0 = 10.0
+    _dtaumax = 1.0e6
+    #least growth of dtau after an accepted step, and its reduction after a
+    #step that increased the residual
+    _dtaugrow = 1.5
+    _dtaushrink = 0.25
+
+    def __init__(self, maxnewton=None, **kwargs):
+        """
+        The unknowns are atms.t and, unless holdtsfc, tsfc. The residual is
+        the net heating rate (K/day, including auxhr) at every level and the
+        surface temperature tendency of RadEqSolver, which is proportional to
+        the TOA imbalance; both vanish in equilibrium (zero heating at all
+        levels and at the top also means a balanced surface).
+
+        Each Newton iteration builds a banded Jacobian J in one batch of
+        radiation calls (bandedjacobian with _precband and _precsmooth),
+        which is both the convergence check and, solved in banded form, the
+        preconditioner of GMRES. GMRES then solves (I/dtau - J) dx = F for
+        the step, with finite-difference Jacobian-vector products, one
+        radiation call each. This is a Newton step regularized by an
+        implicit pseudo-time step dtau (pseudo-transient continuation): the
+        term I/dtau keeps the step finite where J is singular, such as at
+        levels where the HR._maxHR clip flattens the heating rates. The
+        pseudo-time step of each unknown is at most _maxdx/|F|, which bounds
+        the step where J is nearly singular and leaves the Newton step alone
+        near equilibrium, and where J has a positive diagonal (no restoring
+        sensitivity) at most 1/(2 dF/dT). Levels held at the temperature
+        limits of the Atmosphere (where F is zero) are left out of the
+        system, so the step does not pull them off the limit.
+
+        Steps are scaled down to at most _maxdx. dtau starts at _dtau0 and
+        follows the residual norm (at or below _pmax_ref) by switched
+        evolution relaxation: after an accepted step it is multiplied by the
+        ratio of the old to the new norm, but by at least _dtaugrow (when
+        part of the column sits at the clip, the norm falls slowly while the
+        step is still fine), up to _dtaumax, which is practically a pure
+        Newton step. A step that increased the norm is retried from the same
+        state and with the same Jacobian, with dtau cut by _dtaushrink, but
+        not below timestep; a step of dtau = timestep is always accepted, so
+        far from equilibrium the iteration degrades to implicit time steps
+        rather than stalling. Without equilibrium after maxnewton iterations
+        (default _maxnewton) the solver stops.
+
+        On the gray models, where much of the column sits at the clip or at
+        the temperature limits, this takes many more iterations than on
+        models with smooth heating rates such as bands or rrtmg, but still
+        fewer radiation calls than RadEqSolver (see testsolvers.py).
+
+        Equilibrium is declared as for RadEqSolver, when one time step of
+        timestep would change no temperature at or below _pmax_ref, nor
+        tsfc, by more than tol.
+        """
+        super().__init__(**kwargs)
+        if maxnewton is not None:
+            self._maxnewton = maxnewton
+        self.report = None
+
+    def _evaluate(self, atms, x, cparm, lwparm, swparm):
+        """
+        Residual of the state x, computed on a copy of atms.
+        """
+        trial = atms.clone()
+        self._setstate(trial, x)
+        flx = self._radmodel.radiation(trial, cparm, lwparm, swparm)
+        self.radcalls += 1
+        return self._residual(trial, flx)
+
+    def _solverloop(self,atms,cparm,lwparm,swparm):
+        """
+        Newton iterations until equilibrium.
+        """
+        print('{}: running Newton-Krylov solverloop'.format(
+              self.__class__.__name__))
+        st = time.perf_counter()
+        self.radcalls = 0
+        self._equilibrated = False
+        counts = {'newton': 0, 'gmres': 0, 'jacobians': 0, 'rejected': 0}
+
+        idx = atms.p >= self._pmax_ref
+        if not self.holdtsfc:
+            idx = np.append(idx, True)
+        dtau = self._dtau0
+        jac = None
+        for i in range(self._maxnewton):
+            if jac is None:
+                f, jac = bandedjacobian(
+                    self._radmodel, atms, cparm, lwparm, swparm,
+                    self._residual, band=self._precband,
+                    nsmooth=self._precsmooth)
+                counts['jacobians'] += 1
+                fnorm = np.linalg.norm(f[idx])
+            if np.max(np.abs(f[idx]))*self._timestep <= self._tol:
+                self._equilibrated = True
+                self._count = i
+                print("Equilibrium reached ({:d} Newton iterations)".format(
+                      i))
+                break
+            counts['newton'] += 1
+
+            x = self._state(atms)
+            #pseudo-time step of each unknown; levels held at the
+            #temperature limits are left out of the system
+            dt = np.full(len(f), dtau)
+            diag = np.append(jac.diagonal(), jac.tsfc[-1])[:len(f)]
+            pos = diag > 0.0
+            dt[pos] = np.clip(0.5/diag[pos], self._timestep, dtau)
+            dt = np.minimum(dt, self._maxdx/np.maximum(np.abs(f), 1.0e-30))
+            free = ~((f == 0.0) & ((x >= atms._tmax) | (x <= atms._tmin)))
+            dt[~free] = 0.0
+
+            def matvec(v):
+                w = np.where(free, v, 0.0)
+                eps = self._jvdelta/max(np.max(np.abs(w)), 1.0e-30)
+                jv = (self._evaluate(atms, x+eps*w, cparm, lwparm, swparm)
+                      - f)/eps
+                return np.where(free, w/np.where(free, dt, 1.0) - jv, v)
+
+            dx, nit = _gmres(matvec, f, lambda r: jac.implicitsolve(r, dt),
+                             self._gmrestol, self._gmresiter)
+            counts['gmres'] += nit
+            dx[~free] = 0.0
+            dxmax = np.max(np.abs(dx))
+            if dxmax > self._maxdx:
+                dx *= self._maxdx/dxmax
+
+            ftrial = self._evaluate(atms, x+dx, cparm, lwparm, swparm)
+            tnorm = np.linalg.norm(ftrial[idx])
+            if tnorm <= fnorm or dtau <= self._timestep:
+                #switched evolution relaxation: dtau follows the residual
+                self._setstate(atms, x+dx)
+                dtau = min(dtau*max(fnorm/max(tnorm, 1.0e-30),
+                                    self._dtaugrow), self._dtaumax)
+                jac = None
+            else:
+                #retry from x with a smaller pseudo-time step and the same
+                #Jacobian
+                dtau = max(dtau*self._dtaushrink, self._timestep)
+                counts['rejected'] += 1
+        else:
+            print("Max number of iterations reached ({:d})".format(i+1))
+
+        flx = self._radmodel.radiation(atms, cparm, lwparm, swparm)
+        hr = heatingrates(atms, flx)
+        self.radcalls += 1
+
+        self.report = dict(counts, radcalls=self.radcalls,
+                           columns=self.radcalls + counts['jacobians']*(
+                               jacobiancolumns(len(atms.t), self._precband,
+                                               self._precsmooth)),
+                           walltime=time.perf_counter()-st)
+        rstr = ("{cls}: {newton:d} Newton iterations ({rejected:d} "
+                "rejected), {gmres:d} GMRES iterations, {radcalls:d} "
+                "radiation calls and {jacobians:d} Jacobian batches "
+                "({columns:d} columns in all), {walltime:.2f} s")
+        print(rstr.format(cls=self.__class__.__name__, **self.report))
+
+        return atms, flx, hr
@@ -34,8 +34,11 @@ class RCESolver(RadEqSolver):
         super().__init__(**kwargs)
 
     def _do1timestep(self,atms,cparm,lwparm,swparm):
-        atms,flx,hr = super()._do1timestep(atms,cparm,lwparm,swparm)
-        return self._convectiveadjustment(atms,flx,hr)
+        #radiative and convective updates share one grid update
+        with atms.batch():
+            atms,flx,hr = super()._do1timestep(atms,cparm,lwparm,swparm)
+            atms,flx,hr = self._convectiveadjustment(atms,flx,hr)
+        return atms,flx,hr
 
     def _convectiveadjustment(self, atms,flx,hr):
         """
@@ -9,6 +9,7 @@ Created on Fri Nov 18 09:27:09 2016
 """
 
 from radiation.factory import RadModelFactory
+from radiation.radiation import RadModel
 
 class Solver(object):
     """
@@ -20,8 +21,17 @@ class Solver(object):
     _maxsteps = 3000
 
     def __init__(self,radmodel=None, **kwargs):
-        print("assigning radmodel from RadModelFactory.create()")
-        self._radmodel = RadModelFactory.create(
+        """
+        radmodel is a RadModelFactory name, or a RadModel object (e.g. a
+        CachedRadModel) that is used as it is.
+        """
+        if isinstance(radmodel, RadModel):
+            print("assigning radmodel {}".format(
+                  radmodel.__class__.__name__))
+            self._radmodel = radmodel
+        else:
+            print("assigning radmodel from RadModelFactory.create()")
+            self._radmodel = RadModelFactory.create(
                                           radmodel=radmodel, **kwargs)
 
     def _do1timestep(self, atms, cparm, lwparm, swparm):
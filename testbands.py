@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Accuracy of the radiation models against line-by-line calculations.
+
+Compares fluxes and heating rates of every available RadModel with the
+line-by-line (LBL) results for the 12 monthly tropical profiles in
+atmosphere/profiles/hr/LBL_HR/Figure5 (all gases, clear sky). The LBL files
+give the net LW flux and LW heating rate, and the SW heating rate and
+downward flux. Neither the LBL trace gas amounts nor its solar geometry and
+surface albedo are recorded with the data, so the values below are
+assumptions: 400 ppmv CO2, the diurnal mean equatorial sun (mubar, fday)
+scaled to the LBL insolation, and albedo 0.1.
+
+Results (mean over the 12 profiles, 2026-10-18; rrtmg and fu were not
+built at the time):
+
+model     dOLR  dNetLWsfc  LW HR rms     SW abs  SW HR rms
+                           trop  strat           trop  strat
+semigray  46.6   -34.6     2.40  2.41     28.0   0.43  8.68
+bands     -0.4    -0.7     0.21  0.37    -18.0   0.15  0.75
+
+Fluxes in W m-2, heating rates in K/day; trop is 950-100 hPa and strat
+100-1 hPa. SW abs is the error in the SW absorbed by the atmosphere.
+"""
+
+import numpy as np
+import time
+
+
+import atmosphere as a
+import atmosphere.constants as c
+from parm import ChemParm, LWParm, SWParm
+from radiation import RadModelFactory
+import misc.solargeometry as solar
+
+
+# %% set up
+st = time.perf_counter()
+lbldir = 'atmosphere/profiles/hr/LBL_HR/Figure5/'
+nprof = 12
+co2ppmv = 400.0
+albedo = 0.1
+mu = solar.mubar(0, 0)
+fday = solar.fday(0, 0)
+
+#trop and strat pressure ranges (hPa) for the heating rate errors
+ptrop = (100.0, 950.0)
+pstrat = (1.0, 100.0)
+
+models = [name for name in ('semigray', 'bands', 'rrtmg', 'fu')
+          if name in RadModelFactory._classnames]
+
+
+def heating(p, fnet):
+    """Heating rate (K/day) on the levels, without the HR clipping."""
+    f = (c.grav*c.secperdy)/(c.mb2pa*c.cpdair)
+    return f*np.gradient(fnet, p)
+
+
+def column(p, hr):
+    """Column integral of a heating rate profile, as flux (W m-2)."""
+    f = (c.mb2pa*c.cpdair)/(c.grav*c.secperdy)
+    return f*np.sum(0.5*(hr[1:] + hr[:-1])*np.diff(p))
+
+
+def readlbl(i):
+    """Atmosphere and LBL results for profile i."""
+    fname = lbldir + 'atm_pro/{}_atmosprofile.dat'.format(i)
+    with open(fname) as f:
+        tsfc = float(f.readline().split()[0])
+    z, p, t, q, o3 = np.loadtxt(fname, skiprows=1, unpack=True)
+    atms = a.Atmosphere(plev=p, tlev=t, qlev=q, o3lev=o3, tsfc=tsfc,
+                        gridstagger=False, holdrh=False)
+
+    pl, fnetlw, hrlw = np.loadtxt(
+        lbldir + 'lw_hr_lbl_all_gases/{}_LBL_LW_OUTPUT_RADSUM'.format(i),
+        unpack=True)
+    ps, hrsw, fdsw = np.loadtxt(
+        lbldir + 'sw_hr_lbl_all_gases/{}_hr'.format(i), unpack=True)
+    return atms, {'fnetlw': fnetlw, 'hrlw': hrlw, 'hrsw': hrsw,
+                  'fdsw': fdsw}
+
+
+# %% compare
+cparm = ChemParm(co2ppmv=co2ppmv)
+lwparm = LWParm()
+rad = {name: RadModelFactory.create(name) for name in models}
+errors = {name: [] for name in models}
+
+for i in range(1, nprof+1):
+    atms, lbl = readlbl(i)
+    p = atms.plev
+    trop = (p > ptrop[0]) & (p < ptrop[1])
+    strat = (p > pstrat[0]) & (p < pstrat[1])
+    swparm = SWParm(coszen=mu, fday=fday, albedo=albedo,
+                    scon=lbl['fdsw'][0]/(mu*fday))
+    swabs = column(p, lbl['hrsw'])
+
+    for name in models:
+        flx = rad[name].radiation(atms, cparm, lwparm, swparm)
+        hrlw = heating(p, flx.fir)
+        hrsw = heating(p, flx.fsw)
+        errors[name].append((
+            flx.olr - lbl['fnetlw'][0],
+            flx.fir[-1] - lbl['fnetlw'][-1],
+            np.sqrt(np.mean((hrlw - lbl['hrlw'])[trop]**2)),
+            np.sqrt(np.mean((hrlw - lbl['hrlw'])[strat]**2)),
+            column(p, hrsw) - swabs,
+            np.sqrt(np.mean((hrsw - lbl['hrsw'])[trop]**2)),
+            np.sqrt(np.mean((hrsw - lbl['hrsw'])[strat]**2)),
+            ))
+
+
+# %% report
+print('model       dOLR dNetLWsfc  LW HR rms      SW abs   SW HR rms')
+print('                            trop  strat           trop  strat')
+rowstr = '{:9s} {:6.1f}  {:7.1f}  {:5.2f}  {:5.2f}  {:7.1f}  {:5.2f}  {:5.2f}'
+for name in models:
+    print(rowstr.format(name, *np.mean(errors[name], axis=0)))
+
+ed = time.perf_counter()
+timestr = "Elapsed Time: {:4f}s"
+print(timestr.format(ed-st))
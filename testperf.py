@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Performance checks for the model components.
+
+Each cell times one component on the standard 601-level grid and prints the
+per-call cost, so that changes to the hot paths can be compared directly.
+"""
+
+import numpy as np
+import timeit
+
+
+import atmosphere as a
+from misc.humidity import manaberh
+from parm import ChemParm, LWParm, SWParm
+from radiation import RadModelFactory, CachedRadModel, LinearizedRadModel
+from radiation import RadWorkerPool
+from solver import SolverFactory
+
+
+# %% set up
+plev =np.logspace(-2,np.log10(1013), 601)
+atmprof='jtrp'
+nrep = 200
+timestr = "{:<40s} {:10.4f} ms"
+
+atms = a.Atmosphere.mcclatchy(atmprof,p=plev,rhlev=manaberh(plev),
+                              holdrh=True,gridstagger=True)
+
+
+def timecall(func, number=nrep):
+    """Best-of-three mean time per call, in ms."""
+    return 1e3*min(timeit.repeat(func, number=number, repeat=3))/number
+
+
+# %% moisture gradient enforcement
+def enforce_q_gradient_loop(q):
+    """Reference column loop (the original implementation)."""
+    q[-1] = np.maximum(q[-1], atms._qmin)
+    for i in np.arange(len(q)-1,0,-1):
+        q[i-1] = np.maximum(np.minimum(q[i], q[i-1]), atms._qmin)
+    return q
+
+qlev = atms.qlev.copy()
+tloop = timecall(lambda: enforce_q_gradient_loop(qlev.copy()))
+tvec = timecall(lambda: atms._enforce_q_gradient(qlev.copy()))
+print(timestr.format('_enforce_q_gradient (loop)', tloop))
+print(timestr.format('_enforce_q_gradient (vectorized)', tvec))
+#_updatewv calls it once per grid in held-RH mode
+print(timestr.format('saving per timestep', 2*(tloop-tvec)))
+
+qbatch = np.tile(qlev, (50,1))
+print(timestr.format('_enforce_q_gradient (50 columns)',
+      timecall(lambda: atms._enforce_q_gradient(qbatch.copy()))))
+
+
+# %% grid update
+def settemp():
+    atms.t = atms.t + 0.0
+
+print(timestr.format('updategrid via t setter', timecall(settemp)))
+
+
+# %% saturation vapor pressure
+tlay = atms.tlay.copy()
+print(timestr.format('satvap (Goff-Gratch)',
+      timecall(lambda: atms.satvap(tlay))))
+a.Atmosphere.usesatvaptable()
+print(timestr.format('satvap (table)', timecall(lambda: atms.satvap(tlay))))
+print(timestr.format('updategrid via t setter (table)', timecall(settemp)))
+a.Atmosphere.usesatvaptable(False)
+
+
+# %% batched columns
+ncol = 50
+batch = a.AtmosphereBatch.fromcolumns([atms]*ncol)
+
+def settemp_batch():
+    batch.t = batch.t + 0.0
+
+print(timestr.format('updategrid, {} single columns'.format(ncol),
+      ncol*timecall(settemp, number=20)))
+print(timestr.format('updategrid, one {}-column batch'.format(ncol),
+      timecall(settemp_batch, number=20)))
+
+
+# %% gray radiation
+cparm = ChemParm()
+lwparm = LWParm()
+swparm = SWParm(coszen=0.6,fday=0.5,albedo=0.3)
+
+for radmodel in ('gray','semigray'):
+    rad = RadModelFactory.create(radmodel)
+    print(timestr.format('radiation ({})'.format(radmodel),
+          timecall(lambda: rad.radiation(atms,cparm,lwparm,swparm))))
+
+    for kind in ('radeq','rce'):
+        slv = SolverFactory.create(kind=kind,radmodel=radmodel,timestep=0.5)
+        step = atms.clone()
+        print(timestr.format('{} timestep ({})'.format(kind,radmodel),
+              timecall(lambda: slv._do1timestep(step,cparm,lwparm,swparm))))
+
+
+# %% batched radiation
+rad = RadModelFactory.create('semigray')
+columns = [atms]*ncol
+print(timestr.format('radiation, {} single columns'.format(ncol),
+      timecall(lambda: [rad.radiation(col,cparm,lwparm,swparm)
+                        for col in columns], number=20)))
+print(timestr.format('radiation_batch, {} columns'.format(ncol),
+      timecall(lambda: rad.radiation_batch(columns,cparm,lwparm,swparm),
+               number=20)))
+print(timestr.format('radiation_batch, one {}-column batch'.format(ncol),
+      timecall(lambda: rad.radiation_batch(batch,cparm,lwparm,swparm),
+               number=20)))
+
+
+# %% concurrent LW/SW (needs the compiled rrtmg submodule)
+if 'rrtmg' in RadModelFactory._classnames:
+    for mode in (None,'thread','process'):
+        rad = RadModelFactory.create('rrtmg',concurrent=mode)
+        wall = timecall(lambda: rad.radiation(atms,cparm,lwparm,swparm),
+                        number=20)
+        print(timestr.format('rrtmg (concurrent={})'.format(mode), wall))
+        print('    last call: lw {lw:.4f} s, sw {sw:.4f} s, wall {wall:.4f} s'
+              .format(**rad.timings))
+        rad.close()
+
+
+# %% cached radiation
+rad = RadModelFactory.create('semigray')
+cached = CachedRadModel(rad)
+print(timestr.format('radiation (semigray)',
+      timecall(lambda: rad.radiation(atms,cparm,lwparm,swparm))))
+print(timestr.format('radiation (semigray, cache hit)',
+      timecall(lambda: cached.radiation(atms,cparm,lwparm,swparm))))
+print(timestr.format('statekey', timecall(
+      lambda: cached.statekey(atms,cparm,lwparm,swparm))))
+
+
+# %% radiation interval
+for radint in (1, 10):
+    slv = SolverFactory.create(kind='rce',radmodel='semigray',timestep=0.25,
+                               radint=radint)
+    step = atms.clone()
+    wall = timecall(lambda: slv.solve(step.clone(),cparm,lwparm,swparm),
+                    number=1)
+    print(timestr.format('rce solve (radint={}, {} rad. calls)'.format(
+          radint, slv.radcalls), wall))
+
+
+# %% linearized radiation
+for radmodel in ('semigray', 'bands'):
+    for dense in (None, True, False):
+        if dense is None:
+            lin = radmodel
+            label = 'rce solve ({})'.format(radmodel)
+        else:
+            lin = LinearizedRadModel(radmodel, dense=dense)
+            label = 'rce solve ({}, linearized, dense={})'.format(
+                radmodel, dense)
+        slv = SolverFactory.create(kind='rce',radmodel=lin,timestep=0.25)
+        step = atms.clone()
+        wall = timecall(lambda: slv.solve(step.clone(),cparm,lwparm,swparm),
+                        number=1)
+        print(timestr.format(label, wall))
+        if dense is None:
+            print('    radiation calls {}'.format(slv.radcalls))
+        else:
+            print('    full calls {}, jacobians {}, linear calls {}, '
+                  'columns {}'.format(lin.fullcalls, lin.jaccalls,
+                                      lin.linearcalls, lin.columns))
+
+
+# %% worker pool
+rad = RadModelFactory.create('semigray')
+columns = [atms.clone() for i in range(64)]
+print(timestr.format('radiation_batch (semigray, 64 columns)',
+      timecall(lambda: rad.radiation_batch(columns,cparm,lwparm,swparm),
+               number=5)))
+for nworkers in (1, 4):
+    pool = RadWorkerPool('semigray', nworkers=nworkers)
+    pool.radiation_batch(columns,cparm,lwparm,swparm)
+    wall = timecall(lambda: pool.radiation_batch(columns,cparm,lwparm,swparm),
+                    number=5)
+    print(timestr.format('RadWorkerPool ({} workers, 64 columns)'.format(
+          nworkers), wall))
+    pool.close()
+
+
+# %% shortwave reuse (needs the compiled rrtmg submodule)
+if 'rrtmg' in RadModelFactory._classnames:
+    fixedq = atms.clone()
+    fixedq.holdrh = False
+    for swtol in (None, 1.0):
+        rad = RadModelFactory.create('rrtmg',swtol=swtol)
+        slv = SolverFactory.create(kind='rce',radmodel=rad,timestep=0.25)
+        wall = timecall(lambda: slv.solve(fixedq.clone(),cparm,lwparm,swparm),
+                        number=1)
+        print(timestr.format('rce solve (rrtmg, swtol={})'.format(swtol),
+              wall))
+        print('    sw reused {} times'.format(rad.swreused))
+
+
+# %% multi-band model
+for name in ('semigray','bands'):
+    rad = RadModelFactory.create(name)
+    print(timestr.format('radiation ({})'.format(name),
+          timecall(lambda: rad.radiation(atms,cparm,lwparm,swparm))))
+
+
+# %% adaptive time step
+for kind in ('radeq','radeq-adaptive'):
+    slv = SolverFactory.create(kind=kind,radmodel='bands',timestep=0.25)
+    wall = timecall(lambda: slv.solve(atms.clone(),cparm,lwparm,swparm),
+                    number=1)
+    print(timestr.format('{} solve ({} rad. calls)'.format(
+          kind, slv.radcalls), wall))
+
+
+# %% local time steps
+for localdt in (False, True):
+    slv = SolverFactory.create(kind='radeq',radmodel='bands',timestep=0.25,
+                               localdt=localdt)
+    wall = timecall(lambda: slv.solve(atms.clone(),cparm,lwparm,swparm),
+                    number=1)
+    print(timestr.format('radeq solve (localdt={}, {} rad. calls)'.format(
+          localdt, slv.radcalls), wall))
+
+
+# %% Newton-Krylov solver
+for radmodel in ('gray', 'semigray', 'bands'):
+    for kind in ('radeq','radeq-newton'):
+        slv = SolverFactory.create(kind=kind,radmodel=radmodel,timestep=0.25)
+        wall = timecall(lambda: slv.solve(atms.clone(),cparm,lwparm,swparm),
+                        number=1)
+        columns = (slv.report['columns'] if kind == 'radeq-newton'
+                   else slv.radcalls)
+        print(timestr.format('{} {} solve ({} columns)'.format(
+              radmodel, kind, columns), wall))
+
+
+# %% Anderson mixing
+for anderson in (0, 5):
+    slv = SolverFactory.create(kind='rce',radmodel='bands',timestep=0.25,
+                               anderson=anderson)
+    wall = timecall(lambda: slv.solve(atms.clone(),cparm,lwparm,swparm),
+                    number=1)
+    print(timestr.format('rce solve (anderson={}, {} rad. calls)'.format(
+          anderson, slv.radcalls), wall))
+
+
+# %% implicit time steps
+for radmodel in ('gray', 'semigray', 'bands'):
+    for kind in ('radeq','radeq-implicit'):
+        slv = SolverFactory.create(kind=kind,radmodel=radmodel,timestep=0.25)
+        wall = timecall(lambda: slv.solve(atms.clone(),cparm,lwparm,swparm),
+                        number=1)
+        columns = (slv.report['columns'] if kind == 'radeq-implicit'
+                   else slv.radcalls)
+        print(timestr.format('{} {} solve ({} columns)'.format(
+              radmodel, kind, columns), wall))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Convergence of the radiative equilibrium solvers on the gray models.
+
+The gray and semigray models are hard cases for the Newton solver: much of
+the column sits at the HR._maxHR clip or at the temperature limits of the
+Atmosphere, where the heating rates do not depend on the temperature. For
+each model, radeq-newton must reach equilibrium, and its profile must agree
+with explicit time marching converged to a tighter tolerance.
+"""
+
+import io
+import contextlib
+import numpy as np
+import time
+
+
+import atmosphere as a
+from parm import ChemParm, LWParm, SWParm
+from solver import SolverFactory
+from misc.humidity import manaberh
+
+
+# %% set up
+st = time.perf_counter()
+plev = np.logspace(-2, np.log10(1013), 201)
+timestep = 0.25
+tol = 1.0e-3
+#reference: explicit time steps to tol*reftol
+reftol = 0.1
+refsteps = 20000
+#largest allowed difference (K) from the reference at p >= pcheck (hPa)
+maxdiff = 0.5
+pcheck = 10.0
+
+cparm = ChemParm()
+lwparm = LWParm()
+swparm = SWParm(coszen=0.6, fday=0.5, albedo=0.3)
+atms = a.Atmosphere.mcclatchy('jtrp', p=plev, rhlev=manaberh(plev),
+                              holdrh=True, gridstagger=True)
+atms.ozone_fromfile(
+    'atmosphere/profiles/ozone/yang/annual_ozone_20Nto20S.dat')
+
+
+def solve(kind, radmodel, **kwargs):
+    """Solver and equilibrium Atmosphere, with the solver output muted."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        slv = SolverFactory.create(kind=kind, radmodel=radmodel,
+                                   timestep=timestep, **kwargs)
+        eq, flx, hr = slv.solve(atms.clone(), cparm, lwparm, swparm)
+    return slv, eq
+
+
+# %% newton on the gray models
+for radmodel in ('gray', 'semigray'):
+    ref, refatms = solve('radeq', radmodel, tol=tol*reftol,
+                         maxsteps=refsteps)
+    assert ref._equilibrated, (
+        '{}: reference did not converge'.format(radmodel))
+    slv, eq = solve('radeq-newton', radmodel, tol=tol)
+    idx = eq.p >= pcheck
+    diff = np.max(np.abs(eq.t - refatms.t)[idx])
+    print('{}: newton equilibrated {}, {} columns ({} rejected steps), '
+          'max |dT| {:.3f} K, dtsfc {:.3f} K'.format(
+              radmodel, slv._equilibrated, slv.report['columns'],
+              slv.report['rejected'], diff, eq.tsfc - refatms.tsfc))
+    assert slv._equilibrated, '{}: no Newton convergence'.format(radmodel)
+    assert diff <= maxdiff, (
+        '{}: Newton equilibrium off by {:.3f} K'.format(radmodel, diff))
+
+print('Total time: {:.1f} s'.format(time.perf_counter()-st))